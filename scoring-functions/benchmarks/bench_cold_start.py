@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: module import time and first-request latency.
+
+Each run starts a fresh Python process, as a new Lambda container would,
+imports lambda_function (init phase) and then invokes lambda_handler twice
+(first and warm request). Runs are repeated with INIT_PREWARM off and on,
+and optionally for a baseline copy of lambda_function.py to compare before
+and after a change. Every variant is byte-compiled before it is timed, so
+the import measures loading the module and not compiling it (with
+PYTHONDONTWRITEBYTECODE set, an uncompiled copy would be recompiled on
+every run):
+
+    git show HEAD~1:scoring-functions/lambda_function.py > /tmp/lambda_before.py
+    python3 benchmarks/bench_cold_start.py --baseline /tmp/lambda_before.py
+
+By default requests go to benchmarks/mock_lyzr_server.py. Over plain HTTP
+on localhost the connection setup is nearly free, so use --base-url against
+a real HTTPS endpoint to see the effect of prewarming on DNS and TLS.
+
+Usage:
+    python3 benchmarks/bench_cold_start.py -n 10
+    python3 benchmarks/bench_cold_start.py --base-url https://agent-prod.studio.lyzr.ai --api-key sk-...
+"""
+
+import argparse
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_lyzr_server import add_tree_arguments, server_from_args  # noqa: E402
+
+LAMBDA_DIR = Path(__file__).resolve().parent.parent
+
+# Runs in the child process: time the import, then two invocations
+CHILD_SCRIPT = """
+import contextlib, io, json, os, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import lambda_function
+init_ms = (time.perf_counter() - started) * 1000
+pool = lambda_function.HTTP_POOL
+idle = pool.idle_connections(lambda_function.BASE_URL) if hasattr(pool, "idle_connections") else None
+expected_idle = min(lambda_function.INIT_PREWARM_CONNECTIONS, pool.max_per_host) if lambda_function.INIT_PREWARM else 0
+lambda_function.BASE_URL = os.environ["LYZR_BASE_URL"]
+event = json.loads(sys.argv[2])
+latencies = []
+for _ in range(2):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = lambda_function.lambda_handler(dict(event), None)
+    latencies.append((time.perf_counter() - started) * 1000)
+print(json.dumps({"init_ms": init_ms, "first_ms": latencies[0], "warm_ms": latencies[1],
+                  "status": result["statusCode"], "idle": idle, "expected_idle": expected_idle}))
+"""
+
+
+def run_child(module_dir: str, event: dict, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, module_dir, json.dumps(event)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def median(values: list) -> float:
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and first-request latency")
+    add_tree_arguments(parser)
+    parser.add_argument("-n", "--iterations", type=int, default=5, help="Cold starts per variant (default: 5)")
+    parser.add_argument("--baseline", help="Older lambda_function.py to compare against")
+    parser.add_argument("--base-url", help="Send requests to this Lyzr API instead of the mock server")
+    parser.add_argument("--api-key", default="sk-mock", help="API key for --base-url (default: sk-mock)")
+    parser.add_argument("--agent-id", help="Root agent id for --base-url")
+    parser.add_argument("--prewarm-connections", type=int, default=4,
+                        help="INIT_PREWARM_CONNECTIONS for the prewarm variant (default: 4)")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+        agent_id = args.agent_id or "unknown"
+    else:
+        server = server_from_args(args).start()
+        base_url = server.url
+        agent_id = server.root_id
+
+    event = {"agent_id": agent_id, "api_key": args.api_key, "skip_scoring": True}
+
+    variants = [("current", str(LAMBDA_DIR), False), ("current+prewarm", str(LAMBDA_DIR), True)]
+    baseline_dir = None
+    if args.baseline:
+        baseline_dir = tempfile.mkdtemp(prefix="lambda_baseline_")
+        shutil.copy(args.baseline, os.path.join(baseline_dir, "lambda_function.py"))
+        variants.insert(0, ("baseline", baseline_dir, False))
+
+    for module_dir in {module_dir for _, module_dir, _ in variants}:
+        py_compile.compile(os.path.join(module_dir, "lambda_function.py"), doraise=True)
+
+    print(f"Target: {base_url} ({'mock' if server else 'remote'}), {args.iterations} cold starts per variant")
+    print()
+    print(f"{'variant':>16} {'init (ms)':>10} {'first (ms)':>11} {'init+first':>11} {'warm (ms)':>10}")
+    print("-" * 62)
+
+    prewarmed = True
+    try:
+        for label, module_dir, prewarm in variants:
+            env = dict(
+                os.environ,
+                LYZR_BASE_URL=base_url,
+                INIT_PREWARM="true" if prewarm else "false",
+                INIT_PREWARM_CONNECTIONS=str(args.prewarm_connections)
+            )
+            runs = [run_child(module_dir, event, env) for _ in range(args.iterations)]
+            if prewarm:
+                prewarmed &= all(run["idle"] == run["expected_idle"] for run in runs)
+            init_ms = median([run["init_ms"] for run in runs])
+            first_ms = median([run["first_ms"] for run in runs])
+            total_ms = median([run["init_ms"] + run["first_ms"] for run in runs])
+            warm_ms = median([run["warm_ms"] for run in runs])
+            print(f"{label:>16} {init_ms:10.1f} {first_ms:11.1f} {total_ms:11.1f} {warm_ms:10.1f}")
+    finally:
+        if server:
+            server.stop()
+        if baseline_dir:
+            shutil.rmtree(baseline_dir, ignore_errors=True)
+
+    print()
+    print("Medians. init = module import (plus prewarm); first/warm = lambda_handler calls.")
+    print(f"Prewarm left {args.prewarm_connections} idle connection(s) as requested: {'yes' if prewarmed else 'NO'}")
+    sys.exit(0 if prewarmed else 1)
+
+
+if __name__ == "__main__":
+    main()
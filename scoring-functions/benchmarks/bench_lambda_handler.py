@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: lambda_handler against the mock Lyzr API.
+
+Starts benchmarks/mock_lyzr_server.py on a free port, points the Lambda's
+BASE_URL at it, and invokes lambda_handler in-process with timings enabled.
+Reports end-to-end latency and the latency of each phase (tool catalog,
+tree fetch, analysis, scoring) over the runs.
+
+Usage:
+    python3 benchmarks/bench_lambda_handler.py
+    python3 benchmarks/bench_lambda_handler.py --width 5 --depth 3 --latency-ms 50 -n 20
+    python3 benchmarks/bench_lambda_handler.py --scoring-mode local --warm
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import lambda_function  # noqa: E402
+from mock_lyzr_server import add_tree_arguments, server_from_args  # noqa: E402
+
+PHASES = ["load_tools", "fetch_tree", "analyse", "scoring"]
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def invoke(event: dict, quiet: bool = True) -> tuple:
+    """Run lambda_handler and return (status_code, body)."""
+    output = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        result = lambda_function.lambda_handler(event, None)
+    return result["statusCode"], json.loads(result["body"])
+
+
+def print_row(label: str, values: list):
+    if not values:
+        print(f"{label:>12} {'-':>9} {'-':>9} {'-':>9} {'-':>9}")
+        return
+    print(
+        f"{label:>12} {percentile(values, 50):9.1f} {percentile(values, 95):9.1f} "
+        f"{max(values):9.1f} {sum(values) / len(values):9.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lambda_handler against a mock Lyzr API")
+    add_tree_arguments(parser)
+    parser.add_argument("-n", "--iterations", type=int, default=10, help="Timed invocations (default: 10)")
+    parser.add_argument("--scoring-mode", choices=lambda_function.SCORING_MODES, default="llm")
+    parser.add_argument("--skip-scoring", action="store_true", help="Skip scoring")
+    parser.add_argument("--tool-fetch-mode", choices=lambda_function.TOOL_FETCH_MODES, default="full")
+    parser.add_argument("--max-concurrency", type=int, default=lambda_function.FETCH_MAX_WORKERS)
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Keep the agent and score caches between runs (default: no_cache on every run)"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show the Lambda's log output")
+    args = parser.parse_args()
+
+    server = server_from_args(args).start()
+    lambda_function.BASE_URL = server.url
+
+    event = {
+        "agent_id": server.root_id,
+        "api_key": "sk-mock",
+        "timings": True,
+        "no_cache": not args.warm,
+        "skip_scoring": args.skip_scoring,
+        "scoring_mode": args.scoring_mode,
+        "tool_fetch_mode": args.tool_fetch_mode,
+        "max_concurrency": args.max_concurrency,
+    }
+
+    print(
+        f"Tree: width {args.width}, depth {args.depth}, {len(server.agents)} agents, "
+        f"{len(server.tools)} tools; GET latency {args.latency_ms:g} ms, "
+        f"scoring latency {args.scoring_latency_ms:g} ms"
+    )
+
+    # One untimed call opens the pooled connections
+    status, body = invoke(event, not args.verbose)
+    if status != 200:
+        print(f"Warm-up request failed with {status}: {body.get('error')}")
+        server.stop()
+        sys.exit(1)
+
+    totals = []
+    phases = {phase: [] for phase in PHASES}
+    failures = 0
+    upstream = {}
+    for _ in range(args.iterations):
+        status, body = invoke(event, not args.verbose)
+        if status != 200:
+            failures += 1
+            continue
+        timings = body["timings"]
+        totals.append(timings["total_ms"])
+        for phase in PHASES:
+            if phase in timings["phases"]:
+                phases[phase].append(timings["phases"][phase])
+        for name, value in body.get("upstream", {}).items():
+            upstream[name] = upstream.get(name, 0) + value
+
+    server.stop()
+
+    print()
+    print(f"{'phase (ms)':>12} {'p50':>9} {'p95':>9} {'max':>9} {'mean':>9}")
+    print("-" * 52)
+    print_row("end-to-end", totals)
+    for phase in PHASES:
+        print_row(phase, phases[phase])
+    print()
+    print(f"Runs: {len(totals)} ok, {failures} failed")
+    print(f"Upstream totals: {json.dumps(upstream)}")
+    print(f"Mock server requests: {json.dumps(server.stats)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: leaderboard queries against the score history.
+
+Fills a temporary ScoreHistory database with synthetic scores for many
+agents, then times the top, latest and history queries the Lambda serves
+for query=top|latest|history. None of them call the Lyzr API.
+
+Usage:
+    python3 benchmarks/bench_score_history.py
+    python3 benchmarks/bench_score_history.py --agents 2000 --records 200000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lambda_function import ScoreHistory  # noqa: E402
+
+
+def time_call(fn, iterations: int) -> float:
+    """Return the best time per call in milliseconds."""
+    best = float("inf")
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark score history queries")
+    parser.add_argument("--agents", type=int, default=500, help="Distinct root agents (default: 500)")
+    parser.add_argument("--records", type=int, default=50000, help="Scores recorded (default: 50000)")
+    parser.add_argument("--limit", type=int, default=20, help="Rows per query (default: 20)")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="Timed runs per query (default: 20)")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        history = ScoreHistory(os.path.join(directory, "history.sqlite3"), args.records)
+        started = time.perf_counter()
+        for _ in range(args.records):
+            scoring_mode = rng.choice(("llm", "local"))
+            history.record({
+                "root_agent_id": f"agent_{rng.randrange(args.agents):06d}",
+                "agent_name": None,
+                "tree_hash": "%064x" % rng.getrandbits(256),
+                "score": rng.randint(0, 200 if scoring_mode == "llm" else 100),
+                "breakdown": {"architecture": 25, "tools": 25, "knowledge": 25, "quality": 20, "prompts": 60},
+                "scoring_mode": scoring_mode,
+                "cache_hit": False,
+                "timings": {"total_ms": 1000.0, "phases": {}},
+            })
+        record_ms = (time.perf_counter() - started) * 1000 / args.records
+
+        print(f"History: {args.records} scores for {args.agents} agents, {record_ms:.2f} ms per record")
+        print()
+        print(f"{'query':>10} {'rows':>6} {'best (ms)':>10}")
+        print("-" * 28)
+        queries = [
+            ("top", lambda: history.top("llm", args.limit)),
+            ("latest", lambda: history.latest("llm", args.limit)),
+            ("history", lambda: history.history("agent_000000", "llm", args.limit)),
+        ]
+        for label, query in queries:
+            rows = len(query())
+            print(f"{label:>10} {rows:>6} {time_call(query, args.iterations):10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: buffered vs. streaming parse of the /v3/tools/ catalog.
+
+Serves a synthetic catalog of OpenAPI tools from
+benchmarks/mock_lyzr_server.py and builds the tool index three ways:
+
+    buffered          read the whole body, json.loads it and index the full
+                      tools (the behaviour before streaming)
+    buffered+compact  same read, but only compact summaries are kept
+                      (TOOL_CATALOG_STREAM=false)
+    streaming         parse the tools array as it arrives and keep compact
+                      summaries (the default)
+
+For each it reports the tracemalloc peak while loading, the memory still
+held by the index afterwards, and the load time (measured without
+tracemalloc). It also checks that every tool summarises the same way.
+
+Usage:
+    python3 benchmarks/bench_tool_catalog.py
+    python3 benchmarks/bench_tool_catalog.py --tools 5000 --actions 40
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import lambda_function  # noqa: E402
+from mock_lyzr_server import MockLyzrServer, make_tool  # noqa: E402
+
+
+def load_buffered() -> tuple:
+    """The catalog load before streaming: full body, full tools in the index."""
+    result = lambda_function.make_request(f"{lambda_function.BASE_URL}/v3/tools/", "sk-mock")
+    tools = result["tools"]
+    return tools, lambda_function.ToolIndex(tools)
+
+
+def load_with(stream: bool):
+    def load() -> tuple:
+        lambda_function.TOOL_CATALOG_STREAM = stream
+        return lambda_function.load_tools("sk-mock", "full")
+    return load
+
+
+VARIANTS = [
+    ("buffered", load_buffered),
+    ("buffered+compact", load_with(False)),
+    ("streaming", load_with(True)),
+]
+
+
+def measure(load) -> tuple:
+    """Return (result, peak MB, retained MB) of one traced load."""
+    gc.collect()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = load()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1e6, retained / 1e6
+
+
+def best_time(load, iterations: int) -> float:
+    """Best load time in milliseconds."""
+    best = float("inf")
+    for _ in range(iterations):
+        gc.collect()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            load()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def summaries(index) -> list:
+    return [
+        lambda_function.extract_tool_summary({"tool_id": tool_id, "tool_name": ""}, index)
+        for tool_id in sorted(index.by_id)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peak memory of loading the tool catalog")
+    parser.add_argument("--tools", type=int, default=3000, help="Tools in the catalog (default: 3000)")
+    parser.add_argument("--actions", type=int, default=30, help="Operations per tool schema (default: 30)")
+    parser.add_argument("--chunk-size", type=int, default=lambda_function.TOOL_CATALOG_CHUNK_SIZE)
+    parser.add_argument("-n", "--iterations", type=int, default=3, help="Timed loads per variant (default: 3)")
+    args = parser.parse_args()
+
+    tools = [make_tool(n, args.actions) for n in range(args.tools)]
+    server = MockLyzrServer({}, tools, None).start()
+    lambda_function.BASE_URL = server.url
+    lambda_function.TOOL_CATALOG_CHUNK_SIZE = args.chunk_size
+    body_mb = len(server._tools_body) / 1e6
+
+    print(f"Catalog: {args.tools} tools x {args.actions} operations, {body_mb:.1f} MB of JSON")
+    print()
+    print(f"{'variant':>18} {'peak (MB)':>10} {'retained (MB)':>14} {'time (ms)':>10}")
+    print("-" * 56)
+
+    expected = None
+    same = True
+    try:
+        for label, load in VARIANTS:
+            (_, index), peak_mb, retained_mb = measure(load)
+            result = summaries(index)
+            expected = expected if expected is not None else result
+            same &= result == expected and len(index) == args.tools
+            del index
+            load_ms = best_time(load, args.iterations)
+            print(f"{label:>18} {peak_mb:10.1f} {retained_mb:14.1f} {load_ms:10.1f}")
+    finally:
+        server.stop()
+
+    print()
+    print(f"Tool summaries identical across variants: {'yes' if same else 'NO'}")
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
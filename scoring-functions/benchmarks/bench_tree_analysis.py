@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass analyze_tree vs. separate walks.
+
+The separate walks are build_statistics, format_tree_display and a walk
+collecting the truncated nodes, as fetch_and_analyse ran them before the
+single pass. Builds synthetic agent trees with thousands of nodes, checks
+that both approaches produce the same statistics, display text and
+truncated nodes, and reports the time per call. A deep chain is included to show where the recursive
+functions hit Python's recursion limit.
+
+Usage:
+    python3 benchmarks/bench_tree_analysis.py
+    python3 benchmarks/bench_tree_analysis.py --shape 10x3 --shape 4x6 -n 20
+"""
+
+import argparse
+import itertools
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lambda_function import analyze_tree, build_statistics, format_tree_display, truncated_node  # noqa: E402
+
+DEFAULT_SHAPES = ["10x3", "4x6", "30x2", "2x11"]
+DEFAULT_CHAIN_DEPTH = 1200
+
+
+def make_node(node_id: int, depth: int, tools_per_agent: int) -> dict:
+    """Build a tree node shaped like fetch_agent_tree output."""
+    return {
+        "agent": {
+            "id": f"agent-{node_id}",
+            "name": f"Agent {node_id}",
+            "description": "Synthetic agent for benchmarking",
+            "role": "Specialist " * (node_id % 15),
+            "goal": "Answer questions",
+            "model": f"model-{node_id % 3}",
+            "provider": f"provider-{node_id % 2}",
+            "temperature": 0.3,
+            "features": [],
+            "has_instructions": node_id % 4 != 0,
+            "instruction_length": (node_id * 37) % 2000,
+        },
+        "depth": depth,
+        "tools": [
+            {"tool_name": f"tool-{node_id}-{i}", "tool_source": f"source-{i % 2}", "action_names": []}
+            for i in range(tools_per_agent)
+        ],
+        "sub_agents": [],
+        "a2a_tools": [],
+    }
+
+
+def make_tree(width: int, depth: int, tools_per_agent: int = 2) -> dict:
+    """
+    Build a complete tree with the given branching factor and depth.
+
+    Every seventh leaf is replaced by a truncated placeholder.
+    """
+    ids = itertools.count()
+    root = make_node(next(ids), 0, tools_per_agent)
+    level = [root]
+    for current_depth in range(1, depth + 1):
+        next_level = []
+        for parent in level:
+            for _ in range(width):
+                node_id = next(ids)
+                if current_depth == depth and node_id % 7 == 0:
+                    parent["sub_agents"].append(truncated_node(f"agent-{node_id}", current_depth, "max_agents"))
+                    continue
+                child = make_node(node_id, current_depth, tools_per_agent)
+                child["usage_description"] = "Delegate to this agent"
+                parent["sub_agents"].append(child)
+                next_level.append(child)
+        level = next_level
+    return root
+
+
+def make_chain(depth: int) -> dict:
+    """Build a single chain of agents, depth levels deep."""
+    root = make_node(0, 0, 1)
+    node = root
+    for current_depth in range(1, depth + 1):
+        child = make_node(current_depth, current_depth, 1)
+        node["sub_agents"].append(child)
+        node = child
+    return root
+
+
+def count_nodes(tree: dict) -> int:
+    total, stack = 0, [tree]
+    while stack:
+        node = stack.pop()
+        total += 1
+        stack.extend(node.get("sub_agents", []))
+    return total
+
+
+def time_call(fn, iterations: int) -> float:
+    """Return the best time per call in milliseconds."""
+    best = float("inf")
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def find_truncated(tree: dict) -> list:
+    """The truncated-node walk fetch_and_analyse made before the single pass."""
+    found = []
+    stack = [tree] if tree else []
+    while stack:
+        node = stack.pop()
+        if not node:
+            continue
+        if node.get("truncated"):
+            found.append({"id": node.get("id"), "depth": node.get("depth"), "reason": node.get("truncated_reason")})
+        stack.extend(reversed(node.get("sub_agents", [])))
+    return found
+
+
+def separate_walks(tree: dict) -> tuple:
+    return build_statistics(tree), format_tree_display(tree), find_truncated(tree)
+
+
+def single_pass(tree: dict) -> tuple:
+    analysis = analyze_tree(tree)
+    return analysis["statistics"], analysis["display_tree"], analysis["truncated"]
+
+
+def run_shape(label: str, tree: dict, iterations: int):
+    nodes = count_nodes(tree)
+    try:
+        expected = separate_walks(tree)
+        separate_ms = time_call(lambda: separate_walks(tree), iterations)
+    except RecursionError:
+        expected, separate_ms = None, None
+
+    actual = single_pass(tree)
+    single_ms = time_call(lambda: single_pass(tree), iterations)
+
+    if expected is None:
+        same = "n/a"
+        separate = "RecursionError"
+        speedup = "-"
+    else:
+        same = "yes" if expected == actual else "NO"
+        separate = f"{separate_ms:10.2f}"
+        speedup = f"{separate_ms / single_ms:6.2f}x"
+
+    print(f"{label:>12} {nodes:>8} {separate:>14} {single_ms:12.2f} {speedup:>8} {same:>6}")
+    return same != "NO"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tree analysis on synthetic agent trees")
+    parser.add_argument(
+        "--shape",
+        action="append",
+        help="Tree shape as WIDTHxDEPTH (repeatable, default: %s)" % ", ".join(DEFAULT_SHAPES)
+    )
+    parser.add_argument("--tools", type=int, default=2, help="Tools per agent (default: 2)")
+    parser.add_argument(
+        "--chain-depth",
+        type=int,
+        default=DEFAULT_CHAIN_DEPTH,
+        help=f"Depth of the single-chain tree (default: {DEFAULT_CHAIN_DEPTH}, 0 to skip)"
+    )
+    parser.add_argument("-n", "--iterations", type=int, default=10, help="Timed runs per shape (default: 10)")
+    args = parser.parse_args()
+
+    print(f"{'shape':>12} {'nodes':>8} {'separate (ms)':>14} {'single (ms)':>12} {'speedup':>8} {'same':>6}")
+    print("-" * 66)
+
+    ok = True
+    for shape in args.shape or DEFAULT_SHAPES:
+        width, depth = (int(part) for part in shape.lower().split("x"))
+        ok &= run_shape(shape, make_tree(width, depth, args.tools), args.iterations)
+
+    if args.chain_depth:
+        ok &= run_shape(f"chain {args.chain_depth}", make_chain(args.chain_depth), args.iterations)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Lyzr API endpoints used by the scoring Lambda.
+
+Serves a synthetic agent tree and tool catalog:
+
+    GET  /v3/agents/{id}
+    GET  /v3/tools/
+    GET  /v3/tools/{id}
+    POST /v3/inference/chat/
+
+with configurable latency and error injection, so lambda_handler can be
+benchmarked locally and reproducibly. Point the Lambda at it with
+LYZR_BASE_URL=http://127.0.0.1:<port>.
+
+With --serve-lambda the server also runs lambda_handler in-process behind
+POST /fetchAgentsRecursively, shaped like an API Gateway proxy integration,
+so run_tests.py (including its load mode) can target it with
+-e http://127.0.0.1:<port>/fetchAgentsRecursively.
+
+Usage:
+    python3 benchmarks/mock_lyzr_server.py --width 4 --depth 3 --latency-ms 40
+    python3 benchmarks/mock_lyzr_server.py --port 8081 --error-rate 0.05
+    python3 benchmarks/mock_lyzr_server.py --serve-lambda --unknown-as-root
+"""
+
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+LAMBDA_PATH = "/fetchAgentsRecursively"
+
+ROLES = ["Orders", "Returns", "Billing", "Shipping", "Accounts", "Catalog", "Support", "Escalations"]
+
+
+def make_tool(tool_number: int, actions: int = 3) -> dict:
+    """Build an OpenAPI tool shaped like a /v3/tools/ catalog entry."""
+    tool_id = f"openapi-tool_{tool_number}"
+    paths = {
+        f"/tool_{tool_number}/resource_{action}": {
+            "get": {
+                "operationId": f"tool_{tool_number}_action_{action}",
+                "summary": f"Action {action} of tool {tool_number}",
+                "description": "Returns the requested resource. " * 4,
+                "parameters": [
+                    {"name": "id", "in": "query", "required": True, "schema": {"type": "string"}}
+                ],
+                "responses": {"200": {"description": "OK"}},
+            }
+        }
+        for action in range(actions)
+    }
+    return {
+        "tool_id": tool_id,
+        "name": f"Tool {tool_number}",
+        "tool": {"name": f"Tool {tool_number}", "description": f"Synthetic tool {tool_number}"},
+        "schema": {
+            "openapi": "3.0.0",
+            "info": {"title": f"Tool {tool_number}", "version": "1.0"},
+            "servers": [{"url": "https://api.example.com"}],
+            "paths": paths,
+        },
+    }
+
+
+def make_synthetic_tree(
+    width: int = 3,
+    depth: int = 2,
+    tools_per_agent: int = 2,
+    instruction_chars: int = 2000,
+    extra_tools: int = 0
+) -> tuple:
+    """
+    Build a complete agent tree and the tool catalog it references.
+
+    Every agent below the leaves manages width sub-agents, depth levels
+    deep. Each agent references tools_per_agent catalog tools; extra_tools
+    adds unreferenced tools to the catalog. Leaves carry a KNOWLEDGE_BASE
+    feature.
+
+    Returns (agents by id, tools list, root agent id).
+    """
+    agents = {}
+    tools = []
+    counter = [0]
+
+    def new_agent(level: int) -> dict:
+        number = counter[0]
+        counter[0] += 1
+        agent_tools = []
+        for _ in range(tools_per_agent):
+            tool = make_tool(len(tools))
+            tools.append(tool)
+            agent_tools.append(tool)
+
+        agent = {
+            "_id": f"agent_{number:06d}",
+            "name": f"Agent {number}",
+            "description": f"Synthetic agent {number} at depth {level}",
+            "agent_role": f"{ROLES[number % len(ROLES)]} specialist",
+            "agent_goal": "Resolve customer requests accurately",
+            "agent_instructions": ("Follow the escalation policy. " * (instruction_chars // 30 + 1))[:instruction_chars],
+            "model": "gpt-4.1",
+            "provider_id": "OpenAI",
+            "temperature": 0.3,
+            "features": [{"type": "KNOWLEDGE_BASE", "config": {}}] if level == depth else [],
+            "tool_configs": [
+                {
+                    "tool_name": tool["tool_id"],
+                    "tool_source": "openapi",
+                    "action_names": [path["get"]["operationId"] for path in tool["schema"]["paths"].values()],
+                }
+                for tool in agent_tools
+            ],
+            "managed_agents": [],
+        }
+        agents[agent["_id"]] = agent
+        return agent
+
+    root = new_agent(0)
+    level = [root]
+    for current_depth in range(1, depth + 1):
+        next_level = []
+        for parent in level:
+            for _ in range(width):
+                child = new_agent(current_depth)
+                parent["managed_agents"].append({
+                    "id": child["_id"],
+                    "name": child["name"],
+                    "usage_description": f"Delegate {child['agent_role'].lower()} requests",
+                })
+                next_level.append(child)
+        level = next_level
+
+    for _ in range(extra_tools):
+        tools.append(make_tool(len(tools)))
+
+    return agents, tools, root["_id"]
+
+
+def scoring_response(message: str) -> dict:
+    """Build a deterministic scoring agent reply for the submitted tree."""
+    size = len(message)
+    breakdown = {
+        "architecture": 25,
+        "tools": 20 if size % 2 else 25,
+        "knowledge": 25,
+        "quality": 20,
+        "prompts": 60 + size % 40,
+    }
+    breakdown["score"] = sum(breakdown.values())
+    breakdown["debug"] = f"Mock assessment of a {size}-character submission."
+    return {
+        "response": json.dumps({
+            "aggregated": {"mean_score": breakdown["score"], "summary": "Mock score"},
+            "breakdown": breakdown,
+        })
+    }
+
+
+class MockLyzrServer:
+    """
+    Threaded HTTP server serving a synthetic agent tree.
+
+    latency_ms (+ up to jitter_ms) is added to every GET and scoring_latency_ms
+    to every scoring POST. A request fails with error_status with probability
+    error_rate. Unknown agent ids return 404, or the root agent when
+    unknown_as_root is set (so events with real agent ids can be replayed).
+
+    With serve_lambda, POST /fetchAgentsRecursively runs lambda_handler
+    in-process against this server.
+    """
+
+    def __init__(
+        self,
+        agents: dict,
+        tools: list,
+        root_id: str,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        scoring_latency_ms: float = 0,
+        error_rate: float = 0,
+        error_status: int = 503,
+        unknown_as_root: bool = False,
+        serve_lambda: bool = False,
+        seed: int = None
+    ):
+        self.agents = agents
+        self.tools = tools
+        self.tools_by_id = {tool["tool_id"]: tool for tool in tools}
+        self.root_id = root_id
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.scoring_latency_ms = scoring_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.unknown_as_root = unknown_as_root
+        self.serve_lambda = serve_lambda
+        self.random = random.Random(seed)
+        self.stats = {"agents": 0, "tools": 0, "tool": 0, "chat": 0, "lambda": 0, "errors": 0, "not_found": 0}
+        self._lock = threading.Lock()
+        self._tools_body = json.dumps({"tools": tools}).encode("utf-8")
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+        self._lambda = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockLyzrServer":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def delay(self, base_ms: float):
+        with self._lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+        if base_ms or jitter:
+            time.sleep((base_ms + jitter) / 1000)
+        return fail
+
+    def invoke_lambda(self, body: str, query: str, headers: dict = None) -> dict:
+        """Run lambda_handler for an API Gateway style request and return its response."""
+        if self._lambda is None:
+            sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+            import lambda_function
+            lambda_function.BASE_URL = self.url
+            self._lambda = lambda_function
+        event = {
+            "headers": headers or {},
+            "body": body,
+            "queryStringParameters": dict(urllib.parse.parse_qsl(query)) or None,
+        }
+        return self._lambda.lambda_handler(event, None)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; with Nagle on, the
+            # body waits for the client's delayed ACK (~40 ms per request)
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, body):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def fail(self):
+                server.count("errors")
+                self.send_json(server.error_status, {"detail": "injected error"})
+
+            def do_GET(self):
+                parts = [part for part in self.path.split("?")[0].split("/") if part]
+                if server.delay(server.latency_ms):
+                    return self.fail()
+
+                if parts[:2] == ["v3", "agents"] and len(parts) == 3:
+                    server.count("agents")
+                    agent = server.agents.get(parts[2])
+                    if agent is None and server.unknown_as_root:
+                        agent = server.agents[server.root_id]
+                    if agent is None:
+                        server.count("not_found")
+                        return self.send_json(404, {"detail": "Agent not found"})
+                    return self.send_json(200, agent)
+
+                if parts == ["v3", "tools"]:
+                    server.count("tools")
+                    return self.send_json(200, server._tools_body)
+
+                if parts[:2] == ["v3", "tools"] and len(parts) == 3:
+                    server.count("tool")
+                    tool = server.tools_by_id.get(parts[2])
+                    if tool is None:
+                        server.count("not_found")
+                        return self.send_json(404, {"detail": "Tool not found"})
+                    return self.send_json(200, tool)
+
+                server.count("not_found")
+                self.send_json(404, {"detail": "Not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                path, _, query = self.path.partition("?")
+                if server.serve_lambda and path.rstrip("/") == LAMBDA_PATH:
+                    return self.run_lambda(raw, query)
+
+                request = json.loads(raw or b"{}")
+                parts = [part for part in path.split("/") if part]
+                if parts != ["v3", "inference", "chat"]:
+                    server.count("not_found")
+                    return self.send_json(404, {"detail": "Not found"})
+
+                server.count("chat")
+                if server.delay(server.scoring_latency_ms):
+                    return self.fail()
+                self.send_json(200, scoring_response(request.get("message", "")))
+
+            def run_lambda(self, raw: bytes, query: str):
+                server.count("lambda")
+                try:
+                    result = server.invoke_lambda(raw.decode("utf-8") or "{}", query, dict(self.headers))
+                except Exception as e:
+                    return self.send_json(502, {"message": f"Lambda error: {e}"})
+
+                body = result.get("body") or ""
+                data = base64.b64decode(body) if result.get("isBase64Encoded") else body.encode("utf-8")
+                self.send_response(result.get("statusCode", 200))
+                for name, value in (result.get("headers") or {}).items():
+                    self.send_header(name, value)
+                if "Content-Type" not in (result.get("headers") or {}):
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def add_tree_arguments(parser: argparse.ArgumentParser):
+    """Add the synthetic tree and mock server options to a parser."""
+    parser.add_argument("--width", type=int, default=3, help="Sub-agents per agent (default: 3)")
+    parser.add_argument("--depth", type=int, default=2, help="Levels below the root (default: 2)")
+    parser.add_argument("--tools", type=int, default=2, help="Tools per agent (default: 2)")
+    parser.add_argument("--extra-tools", type=int, default=0, help="Unreferenced catalog tools (default: 0)")
+    parser.add_argument("--instruction-chars", type=int, default=2000, help="Instruction length per agent (default: 2000)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency added to each GET (default: 20)")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency per request (default: 0)")
+    parser.add_argument("--scoring-latency-ms", type=float, default=200, help="Latency of the scoring POST (default: 200)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests that fail (default: 0)")
+    parser.add_argument("--error-status", type=int, default=503, help="Status of injected errors (default: 503)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for jitter and errors")
+
+
+def server_from_args(
+    args,
+    port: int = 0,
+    unknown_as_root: bool = False,
+    serve_lambda: bool = False
+) -> MockLyzrServer:
+    """Build a MockLyzrServer from add_tree_arguments options."""
+    agents, tools, root_id = make_synthetic_tree(
+        args.width, args.depth, args.tools, args.instruction_chars, args.extra_tools
+    )
+    return MockLyzrServer(
+        agents,
+        tools,
+        root_id,
+        port=port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        scoring_latency_ms=args.scoring_latency_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        unknown_as_root=unknown_as_root,
+        serve_lambda=serve_lambda,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic agent tree as a mock Lyzr API")
+    parser.add_argument("--port", type=int, default=8081, help="Port to listen on (default: 8081)")
+    parser.add_argument(
+        "--unknown-as-root",
+        action="store_true",
+        help="Serve the root agent for unknown agent ids instead of 404"
+    )
+    parser.add_argument(
+        "--serve-lambda",
+        action="store_true",
+        help=f"Also run lambda_handler in-process behind POST {LAMBDA_PATH}"
+    )
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, args.port, args.unknown_as_root, args.serve_lambda)
+    print(f"Mock Lyzr API on {server.url}")
+    print(f"Root agent: {server.root_id} ({len(server.agents)} agents, {len(server.tools)} tools)")
+    if args.serve_lambda:
+        print(f"Lambda endpoint: {server.url}{LAMBDA_PATH}")
+    else:
+        print(f"Run the Lambda with LYZR_BASE_URL={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,1252 @@
+import codecs
+import hashlib
+import io
 import json
-import urllib.request
-import urllib.error
-import uuid
+import http.client
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from typing import Optional
 import os
-BASE_URL = "https://agent-prod.studio.lyzr.ai"
+BASE_URL = os.getenv("LYZR_BASE_URL", "https://agent-prod.studio.lyzr.ai")
+
+# Headers shared by every JSON request to the Lyzr API (x-api-key is added per call)
+JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json"
+}
+
+# Maximum number of agent fetches in flight at once (1 = sequential)
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "8"))
+
+# Tool enrichment: "full" downloads the whole tool catalog, "lazy" fetches
+# only the tools referenced by the agent tree
+TOOL_FETCH_MODES = ("full", "lazy")
+TOOL_FETCH_MODE = os.getenv("TOOL_FETCH_MODE", "full")
+
+# Parse the /v3/tools/ catalog as it streams in, keeping only compact tool
+# summaries instead of every tool's full OpenAPI schema
+TOOL_CATALOG_STREAM = os.getenv("TOOL_CATALOG_STREAM", "true").lower() == "true"
+TOOL_CATALOG_CHUNK_SIZE = int(os.getenv("TOOL_CATALOG_CHUNK_SIZE", "65536"))
+
+# Tool ids look like "<prefix>-<name>"; lazy mode only fetches references
+# of this form, since /v3/tools/{id} cannot resolve names or id suffixes
+TOOL_ID_PATTERN = re.compile(r"[^\s-]+-\S+")
+
+# Whitespace and commas between elements of a streamed JSON array
+JSON_ARRAY_SEPARATOR = re.compile(r"[\s,]*")
+# What must follow a bare number or literal before it is known to be complete
+JSON_ARRAY_VALUE_END = re.compile(r"\s*[,\]]")
+JSON_OBJECT_VALUE_END = re.compile(r"\s*[,}]")
+JSON_WHITESPACE = re.compile(r"\s*")
+JSON_KEY_SEPARATOR = re.compile(r"\s*:")
+
+# Upstream GET timeout in seconds
+REQUEST_TIMEOUT = 30
+
+# Fetch limits: unique agents fetched, levels below the root, and time kept
+# back from the Lambda deadline for scoring and the response
+FETCH_MAX_AGENTS = int(os.getenv("FETCH_MAX_AGENTS", "100"))
+FETCH_MAX_DEPTH = int(os.getenv("FETCH_MAX_DEPTH", "10"))
+FETCH_DEADLINE_RESERVE_MS = int(os.getenv("FETCH_DEADLINE_RESERVE_MS", "10000"))
+# Highest max_depth a request may ask for: the response and scoring payload
+# are nested one JSON level per agent level, so deeper trees would hit the
+# recursion limit when they are serialized
+FETCH_MAX_DEPTH_LIMIT = 200
+
+# Keep-alive connection pool limits
+HTTP_POOL_MAX_PER_HOST = int(os.getenv("HTTP_POOL_MAX_PER_HOST", "10"))
+HTTP_POOL_IDLE_TIMEOUT = float(os.getenv("HTTP_POOL_IDLE_TIMEOUT", "50"))
+
+# Open connections to BASE_URL at module load, so DNS, TCP and TLS setup
+# happen in the Lambda init phase instead of on the first request
+INIT_PREWARM = os.getenv("INIT_PREWARM", "false").lower() == "true"
+INIT_PREWARM_CONNECTIONS = int(os.getenv("INIT_PREWARM_CONNECTIONS", "2"))
+INIT_PREWARM_TIMEOUT = float(os.getenv("INIT_PREWARM_TIMEOUT", "3"))
+
+# Upstream resilience: retries for idempotent GETs (jittered exponential
+# backoff), optional hedged GETs after the recent p95 latency, and a per-host
+# circuit breaker that fails fast while the Lyzr API is degraded
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Lyzr rate-limits per API key, so a 429 is retried but says nothing about
+# the host and never counts toward its circuit breaker
+THROTTLED_STATUS = 429
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = 20
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Agent configuration cache (kept across warm invocations)
+AGENT_CACHE_MAX_SIZE = int(os.getenv("AGENT_CACHE_MAX_SIZE", "512"))
+AGENT_CACHE_TTL = float(os.getenv("AGENT_CACHE_TTL", "300"))
+
+# Score cache keyed on the canonical agent tree: "memory", "sqlite" or "none"
+SCORE_CACHE_BACKEND = os.getenv("SCORE_CACHE_BACKEND", "memory")
+SCORE_CACHE_MAX_SIZE = int(os.getenv("SCORE_CACHE_MAX_SIZE", "256"))
+SCORE_CACHE_PATH = os.getenv("SCORE_CACHE_PATH", "/tmp/lyzr_score_cache.sqlite3")
+
+# Fields that change between fetches without changing the agent configuration
+VOLATILE_TREE_FIELDS = {"session_id", "request_id", "created_at", "updated_at", "timestamp"}
 
 # Scoring agent configuration
 SCORING_AGENT_ID = "697b2ab3c03792e039e5ccb2"
 SCORING_AGENT_API_KEY = os.getenv("SCORING_AGENT_API_KEY", "sk-default-scoringAgentAPIKey123456")
 
+# Scoring modes: "llm" (scoring agent only), "local" (rule engine only),
+# "hybrid" (rule engine + scoring agent for prompt quality), "fanout" (one
+# concurrent scoring call per agent, aggregated locally), "incremental"
+# (fanout, re-scoring only agents changed since the last run)
+SCORING_MODES = ("llm", "local", "hybrid", "fanout", "incremental")
+SCORING_MODE = os.getenv("SCORING_MODE", "llm")
+
+# Rubric categories computed by the local rule engine (25 points each)
+LOCAL_SCORE_CATEGORIES = ("architecture", "tools", "knowledge", "quality")
+SCORE_CATEGORIES = LOCAL_SCORE_CATEGORIES + ("prompts",)
+TSHIRT_POINTS = {"XS": 5, "S": 10, "M": 15, "L": 20, "XL": 25}
+
+# Compact scoring payload: send only rubric-relevant fields, within a
+# character budget (roughly 4 characters per token)
+SCORING_PAYLOAD_COMPACT = os.getenv("SCORING_PAYLOAD_COMPACT", "true").lower() == "true"
+SCORING_PAYLOAD_MAX_CHARS = int(os.getenv("SCORING_PAYLOAD_MAX_CHARS", "24000"))
+CHARS_PER_TOKEN = 4
+
+# Multi-sample scoring: up to SCORING_MAX_SAMPLES concurrent scoring calls,
+# stopping early once SCORING_AGREE_K samples return the same breakdown
+SCORING_MAX_SAMPLES = int(os.getenv("SCORING_MAX_SAMPLES", "5"))
+SCORING_AGREE_K = int(os.getenv("SCORING_AGREE_K", "2"))
+
+# Per-agent scoring: max scoring calls in flight, and the store of the last
+# per-agent results for each root agent used by incremental scoring
+SCORING_FANOUT_MAX_WORKERS = int(os.getenv("SCORING_FANOUT_MAX_WORKERS", "8"))
+AGENT_SCORE_STORE_BACKEND = os.getenv("AGENT_SCORE_STORE_BACKEND", "memory")
+AGENT_SCORE_STORE_MAX_SIZE = int(os.getenv("AGENT_SCORE_STORE_MAX_SIZE", "256"))
+AGENT_SCORE_STORE_PATH = os.getenv("AGENT_SCORE_STORE_PATH", "/tmp/lyzr_agent_scores.sqlite3")
+
+# Share one fetch-and-score between identical requests running at the same
+# time in this process (same agent, API key and scoring options)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+# Per-API-key admission limit: sustained requests per second and burst size.
+# Requests over the limit get a 429 with Retry-After. 0 disables the limit.
+ADMISSION_RATE_PER_KEY = float(os.getenv("ADMISSION_RATE_PER_KEY", "0"))
+ADMISSION_BURST_PER_KEY = int(os.getenv("ADMISSION_BURST_PER_KEY", "10"))
+ADMISSION_MAX_KEYS = 1024
+
+# Batch requests: max entries per request and entries processed at once
+BATCH_MAX_ENTRIES = int(os.getenv("BATCH_MAX_ENTRIES", "100"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+
+# Response encoding: bodies at least this large are gzipped for clients that
+# send Accept-Encoding: gzip (API Gateway passes them through base64-encoded)
+RESPONSE_GZIP_MIN_BYTES = int(os.getenv("RESPONSE_GZIP_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+
+# Async scoring jobs: "memory" or "sqlite" store, jobs expire after JOB_TTL seconds
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "memory")
+JOB_STORE_MAX_SIZE = int(os.getenv("JOB_STORE_MAX_SIZE", "1024"))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/tmp/lyzr_scoring_jobs.sqlite3")
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+
+# How async jobs are scored: "lambda" hands each job to an asynchronous
+# invocation of this function (the job store must be shared, e.g. sqlite on
+# EFS); "thread" scores in a background thread, which Lambda freezes once the
+# handler returns, so it only suits running off Lambda
+ASYNC_DISPATCH = os.getenv("ASYNC_DISPATCH", "lambda" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "thread")
+ASYNC_FUNCTION_NAME = os.getenv("ASYNC_FUNCTION_NAME", os.getenv("AWS_LAMBDA_FUNCTION_NAME", ""))
+
+# Score history for leaderboard queries: "sqlite" or "none". The oldest
+# records are dropped beyond SCORE_HISTORY_MAX_ROWS.
+SCORE_HISTORY_BACKEND = os.getenv("SCORE_HISTORY_BACKEND", "sqlite")
+SCORE_HISTORY_PATH = os.getenv("SCORE_HISTORY_PATH", "/tmp/lyzr_score_history.sqlite3")
+SCORE_HISTORY_MAX_ROWS = int(os.getenv("SCORE_HISTORY_MAX_ROWS", "100000"))
+SCORE_HISTORY_MAX_LIMIT = 1000
+SCORE_HISTORY_QUERIES = ("top", "latest", "history")
+
+# Score history queries need api_key=SCORE_HISTORY_API_KEY. Without one they
+# are refused unless SCORE_HISTORY_PUBLIC=true opens them to everyone.
+SCORE_HISTORY_API_KEY = os.getenv("SCORE_HISTORY_API_KEY", "")
+SCORE_HISTORY_PUBLIC = os.getenv("SCORE_HISTORY_PUBLIC", "false").lower() == "true"
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, pooled per host.
 
+    Connections are reused across calls and across warm Lambda invocations.
+    At most max_per_host requests are in flight to a host at once, and up to
+    that many idle connections are kept. A request on a reused connection
+    that the server has already closed is retried once on a fresh one.
+    """
 
-def make_request(url: str, api_key: str) -> Optional[dict]:
-    """Make an authenticated GET request to the Lyzr API."""
-    headers = {
-        "x-api-key": api_key,
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    req = urllib.request.Request(url, headers=headers, method="GET")
+    def __init__(self, max_per_host: int = HTTP_POOL_MAX_PER_HOST, idle_timeout: float = HTTP_POOL_IDLE_TIMEOUT):
+        self.max_per_host = max(1, max_per_host)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self._ssl_context = None
+
+    def _slot(self, key: tuple) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _checkout(self, key: tuple, timeout: float) -> tuple:
+        """Return (connection, reused) for the host, preferring an idle connection."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn.timeout = timeout
+                    if conn.sock:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context()), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def ssl_context(self) -> ssl.SSLContext:
+        """Default TLS context, created once and shared by all connections."""
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return self._ssl_context
+
+    def _checkin(self, key: tuple, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method: str, url: str, headers: dict = None, body: bytes = None, timeout: float = 30) -> tuple:
+        """
+        Send a request and return (status, reason, body bytes).
+
+        Raises OSError or http.client.HTTPException on transport failures.
+        """
+        key, path = self._target(url)
+        slot = self._slot(key)
+        slot.acquire()
+        try:
+            conn, response = self._send(key, method, path, body, headers, timeout)
+            try:
+                data = response.read()
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return response.status, response.reason, data
+        finally:
+            slot.release()
+
+    @contextmanager
+    def stream(self, method: str, url: str, headers: dict = None, timeout: float = 30):
+        """
+        Send a request and yield the response for incremental reads.
+
+        The connection goes back to the pool only if the body was read to
+        the end; otherwise it is closed.
+        """
+        key, path = self._target(url)
+        slot = self._slot(key)
+        slot.acquire()
+        try:
+            conn, response = self._send(key, method, path, None, headers, timeout)
+            try:
+                yield response
+            except BaseException:
+                conn.close()
+                raise
+            if response.isclosed() and not response.will_close:
+                self._checkin(key, conn)
+            else:
+                conn.close()
+        finally:
+            slot.release()
+
+    def _send(self, key: tuple, method: str, path: str, body: bytes, headers: dict, timeout: float) -> tuple:
+        """Send a request and return (connection, response) once the headers are in."""
+        while True:
+            conn, reused = self._checkout(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return conn, conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if reused:
+                    # Stale keep-alive socket; retry on a fresh connection
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+
+    @staticmethod
+    def _target(url: str) -> tuple:
+        """Return the pool key and request path for a URL."""
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        return (parsed.scheme, parsed.hostname, parsed.port), path
+
+    def prewarm(self, url: str, connections: int = 1, timeout: float = 3) -> int:
+        """
+        Open idle connections to the URL's host ahead of the first request.
+
+        Returns the number of connections opened. Raises OSError on
+        connection failures. All connections are checked out before any is
+        checked back in, so each pass opens a new one instead of taking the
+        previous pass's idle connection.
+        """
+        key, _ = self._target(url)
+        checked_out, opened = [], 0
+        try:
+            for _ in range(max(1, min(connections, self.max_per_host))):
+                conn, reused = self._checkout(key, timeout)
+                if not reused:
+                    try:
+                        conn.connect()
+                    except Exception:
+                        conn.close()
+                        raise
+                    opened += 1
+                checked_out.append(conn)
+        finally:
+            for conn in checked_out:
+                self._checkin(key, conn)
+        return opened
+
+    def idle_connections(self, url: str) -> int:
+        """Number of idle connections pooled for the URL's host."""
+        key, _ = self._target(url)
+        with self._lock:
+            return len(self._idle.get(key, []))
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+
+# Module-level pool, reused across warm invocations
+HTTP_POOL = ConnectionPool()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with an optional per-entry time-to-live."""
+
+    def __init__(self, max_size: int, ttl: float = None):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key: str):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value):
+        """Store a value, evicting the least recently used entries if full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
+
+
+class SQLiteCache:
+    """
+    Key/value cache stored in a local SQLite file.
+
+    Values are stored as JSON, so they survive container restarts when the
+    file lives on persistent storage. The oldest entries are evicted once
+    max_size is exceeded. With a ttl, entries expire ttl seconds after they
+    were last set; expiry uses wall-clock time, so it holds across the
+    containers sharing the file.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float = None):
+        import sqlite3
+
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL, expires_at REAL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(cache)")]
+        if "expires_at" not in columns:
+            # Files written before entries could expire
+            self._conn.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_updated_at ON cache (updated_at)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        """Store a value, dropping expired entries and evicting the oldest if full."""
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, expires_at)
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_size
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY updated_at LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": size,
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "path": self.path,
+            }
+
+
+def create_cache(backend: str, max_size: int, path: str = None, ttl: float = None):
+    """Create a cache for the given backend name ("memory", "sqlite" or "none")."""
+    if backend == "memory":
+        return TTLCache(max_size, ttl)
+    if backend == "sqlite":
+        return SQLiteCache(path, max_size, ttl)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class ScoreHistory:
+    """
+    Every successful score, stored in a local SQLite file for leaderboards.
+
+    Scores are only comparable within a scoring mode (local scores are out
+    of 100, the others out of 200), so every query is for one mode. Records
+    are indexed on (scoring_mode, root_agent_id, created_at) for per-agent
+    history and latest scores, and on (scoring_mode, score, created_at) for
+    the top-N query, so queries read an index instead of scanning the
+    table. The database is opened on first use to keep it out of the init
+    phase.
+    """
+
+    COLUMNS = (
+        "root_agent_id", "agent_name", "tree_hash", "score", "breakdown",
+        "scoring_mode", "cache_hit", "timings", "created_at",
+    )
+
+    def __init__(self, path: str, max_rows: int):
+        self.path = path
+        self.max_rows = max(1, max_rows)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            import sqlite3
+
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "id INTEGER PRIMARY KEY, root_agent_id TEXT NOT NULL, agent_name TEXT, "
+                "tree_hash TEXT NOT NULL, score NUMERIC NOT NULL, breakdown TEXT NOT NULL, "
+                "scoring_mode TEXT, cache_hit INTEGER NOT NULL, timings TEXT, created_at REAL NOT NULL)"
+            )
+            # Replaced by the per-mode indexes below
+            conn.execute("DROP INDEX IF EXISTS scores_agent_created")
+            conn.execute("DROP INDEX IF EXISTS scores_score")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS scores_mode_agent_created "
+                "ON scores (scoring_mode, root_agent_id, created_at)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS scores_mode_score ON scores (scoring_mode, score, created_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record(self, record: dict):
+        """Append a record (a dict with the COLUMNS except created_at)."""
+        values = dict(record, created_at=time.time())
+        values["breakdown"] = json.dumps(values["breakdown"])
+        values["timings"] = json.dumps(values["timings"]) if values.get("timings") else None
+        values["cache_hit"] = int(bool(values["cache_hit"]))
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                f"INSERT INTO scores ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [values.get(column) for column in self.COLUMNS]
+            )
+            conn.execute("DELETE FROM scores WHERE id <= ?", (cursor.lastrowid - self.max_rows,))
+            conn.commit()
+
+    def top(self, scoring_mode: str, limit: int) -> list:
+        """Each agent's best score in scoring_mode, highest first."""
+        results, seen = [], set()
+        with self._lock:
+            cursor = self._connection().execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM scores WHERE scoring_mode = ? "
+                "ORDER BY score DESC, created_at DESC",
+                (scoring_mode,)
+            )
+            for row in cursor:
+                if row[0] in seen:
+                    continue
+                seen.add(row[0])
+                results.append(self._record(row))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def latest(self, scoring_mode: str, limit: int) -> list:
+        """Each agent's most recent score in scoring_mode, highest first."""
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM scores WHERE id IN "
+                "(SELECT MAX(id) FROM scores WHERE scoring_mode = ? GROUP BY root_agent_id) "
+                "ORDER BY score DESC, created_at DESC LIMIT ?",
+                (scoring_mode, limit)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def history(self, root_agent_id: str, scoring_mode: str, limit: int) -> list:
+        """An agent's scores in scoring_mode, newest first."""
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM scores WHERE root_agent_id = ? AND scoring_mode = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (root_agent_id, scoring_mode, limit)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def _record(self, row: tuple) -> dict:
+        record = dict(zip(self.COLUMNS, row))
+        record["breakdown"] = json.loads(record["breakdown"])
+        record["timings"] = json.loads(record["timings"]) if record["timings"] else None
+        record["cache_hit"] = bool(record["cache_hit"])
+        return record
+
+
+def create_score_history(backend: str, path: str, max_rows: int) -> Optional[ScoreHistory]:
+    """Create the score history for the given backend name ("sqlite" or "none")."""
+    if backend == "sqlite":
+        return ScoreHistory(path, max_rows)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown score history backend: {backend}")
+
+
+AGENT_CACHE = TTLCache(AGENT_CACHE_MAX_SIZE, AGENT_CACHE_TTL)
+SCORE_CACHE = create_cache(SCORE_CACHE_BACKEND, SCORE_CACHE_MAX_SIZE, SCORE_CACHE_PATH)
+JOB_STORE = create_cache(JOB_STORE_BACKEND, JOB_STORE_MAX_SIZE, JOB_STORE_PATH, ttl=JOB_TTL)
+AGENT_SCORE_STORE = create_cache(AGENT_SCORE_STORE_BACKEND, AGENT_SCORE_STORE_MAX_SIZE, AGENT_SCORE_STORE_PATH)
+SCORE_HISTORY = create_score_history(SCORE_HISTORY_BACKEND, SCORE_HISTORY_PATH, SCORE_HISTORY_MAX_ROWS)
+
+
+def agent_cache_key(agent_id: str, api_key: str) -> str:
+    """Cache key for an agent, scoped to the API key without storing it."""
+    return hashlib.sha256(f"{api_key}:{agent_id}".encode("utf-8")).hexdigest()
+
+
+class Timings:
+    """
+    Phase durations and per-agent fetch durations for one invocation.
+
+    Spans with the same name (e.g. from batch entries running in parallel)
+    are summed. Durations are reported in milliseconds.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.agents = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds * 1000
+
+    def add_agent(self, agent_id: str, seconds: float):
+        with self._lock:
+            self.agents[agent_id] = round(seconds * 1000, 1)
+
+    def total_ms(self) -> float:
+        return round((time.monotonic() - self.started) * 1000, 1)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_ms": self.total_ms(),
+                "phases": {name: round(ms, 1) for name, ms in self.phases.items()},
+                "agent_fetch_ms": dict(self.agents),
+            }
+
+
+@contextmanager
+def span(timings: Optional[Timings], name: str):
+    """Time a block into timings, or do nothing when timings is None."""
+    if timings is None:
+        yield
+    else:
+        with timings.span(name):
+            yield
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream host.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast. After reset_timeout seconds one trial call is let through
+    (half-open); its outcome closes or re-opens the circuit. If no outcome
+    is recorded within another reset_timeout, a new trial is let through,
+    so a lost trial cannot hold the circuit half-open.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may be made now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.trial_at = now
+                return True
+            if self.state == "half_open" and now - self.trial_at >= self.reset_timeout:
+                self.trial_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_throttled(self):
+        """A rate-limited response: the host is up, so end a half-open trial."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "closed"
+                self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class UpstreamStats:
+    """Counters and recent GET latencies for upstream calls."""
+
+    COUNTERS = (
+        "requests", "retries", "hedges", "hedge_wins", "breaker_rejections", "failures", "throttled",
+        "bytes_received",
+    )
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.COUNTERS, 0)
+        self._latencies = deque(maxlen=window)
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def p95_latency(self) -> Optional[float]:
+        """p95 of recent GET latencies, or None until there are enough samples."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+CIRCUIT_BREAKERS = {}
+CIRCUIT_BREAKERS_LOCK = threading.Lock()
+UPSTREAM_STATS = UpstreamStats()
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+def upstream_delta(before: dict) -> dict:
+    """Upstream counters accumulated since the given UPSTREAM_STATS snapshot."""
+    after = UPSTREAM_STATS.snapshot()
+    return {name: after[name] - before[name] for name in after}
+
+
+def circuit_breaker_for(url: str) -> CircuitBreaker:
+    """Return the circuit breaker of the URL's host."""
+    host = urllib.parse.urlsplit(url).netloc
+    with CIRCUIT_BREAKERS_LOCK:
+        if host not in CIRCUIT_BREAKERS:
+            CIRCUIT_BREAKERS[host] = CircuitBreaker()
+        return CIRCUIT_BREAKERS[host]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    import random
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def retry_after_backoff(attempt: int, attempts: int, deadline: Optional[float]) -> bool:
+    """
+    Sleep before the next attempt and return True, or return False if no
+    attempts are left or the backoff would reach the deadline.
+    """
+    if attempt + 1 >= attempts:
+        return False
+    delay = backoff_delay(attempt)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return False
+    time.sleep(delay)
+    return True
+
+
+def hedged_request(method: str, url: str, headers: dict, body: bytes, timeout: float) -> tuple:
+    """
+    Send a request and, if it is slower than the recent p95, a second copy.
+
+    Returns the first successful response; the slower copy is ignored.
+    """
+    delay = max(HEDGE_MIN_DELAY, UPSTREAM_STATS.p95_latency() or 0)
+    primary = HEDGE_EXECUTOR.submit(HTTP_POOL.request, method, url, headers, body, timeout)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+
+    UPSTREAM_STATS.incr("hedges")
+    hedge = HEDGE_EXECUTOR.submit(HTTP_POOL.request, method, url, headers, body, timeout)
+    error = None
+    for future in as_completed([primary, hedge]):
+        try:
+            result = future.result()
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+            continue
+        if future is hedge:
+            UPSTREAM_STATS.incr("hedge_wins")
+        return result
+    raise error
+
+
+def upstream_request(
+    method: str,
+    url: str,
+    headers: dict,
+    body: bytes = None,
+    timeout: float = REQUEST_TIMEOUT,
+    idempotent: bool = False,
+    deadline: float = None
+) -> tuple:
+    """
+    Send a request through the circuit breaker, retrying idempotent requests.
+
+    Idempotent requests are retried on transport errors and retryable status
+    codes, and hedged when HEDGE_REQUESTS is enabled. With a deadline (a
+    time.monotonic() value), each attempt's timeout is cut to the time left
+    (at least 1 second for the first attempt) and no retry starts whose
+    backoff would reach the deadline. Returns (status, reason, body bytes)
+    like ConnectionPool.request; raises CircuitOpenError when the host's
+    circuit is open.
+    """
+    breaker = circuit_breaker_for(url)
+    attempts = max(1, RETRY_MAX_ATTEMPTS) if idempotent else 1
+
+    for attempt in range(attempts):
+        if not breaker.allow():
+            UPSTREAM_STATS.incr("breaker_rejections")
+            raise CircuitOpenError(f"circuit open for {urllib.parse.urlsplit(url).netloc}")
+
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            attempt_timeout = min(timeout, max(0.1 if attempt else 1.0, remaining))
+
+        UPSTREAM_STATS.incr("retries" if attempt else "requests")
+        started = time.monotonic()
+        try:
+            if idempotent and HEDGE_REQUESTS:
+                status, reason, data = hedged_request(method, url, headers, body, attempt_timeout)
+            else:
+                status, reason, data = HTTP_POOL.request(method, url, headers, body, attempt_timeout)
+        except (OSError, http.client.HTTPException):
+            breaker.record_failure()
+            UPSTREAM_STATS.incr("failures")
+            if retry_after_backoff(attempt, attempts, deadline):
+                continue
+            raise
+
+        if status in RETRYABLE_STATUSES:
+            if status == THROTTLED_STATUS:
+                breaker.record_throttled()
+                UPSTREAM_STATS.incr("throttled")
+            else:
+                breaker.record_failure()
+                UPSTREAM_STATS.incr("failures")
+            if retry_after_backoff(attempt, attempts, deadline):
+                continue
+        else:
+            breaker.record_success()
+            UPSTREAM_STATS.incr("bytes_received", len(data))
+            if idempotent:
+                UPSTREAM_STATS.record_latency(time.monotonic() - started)
+        return status, reason, data
+
+
+def canonical_tree_hash(agent_tree: dict) -> str:
+    """
+    Content hash of the agent tree: sorted keys, no whitespace, no volatile fields.
+
+    The hashed text is json.dumps(tree, sort_keys=True, separators=(",", ":"))
+    with VOLATILE_TREE_FIELDS dropped from every object, built with an
+    explicit stack so deep trees cannot hit the recursion limit.
+    """
+    encode = json.dumps
+    parts = []
+    # Stack entries: (True, literal text) or (False, value to encode)
+    stack = [(False, agent_tree)]
+    while stack:
+        literal, value = stack.pop()
+        if literal:
+            parts.append(value)
+        elif isinstance(value, dict):
+            keys = sorted(key for key in value if key not in VOLATILE_TREE_FIELDS)
+            stack.append((True, "}"))
+            for position in range(len(keys) - 1, -1, -1):
+                stack.append((False, value[keys[position]]))
+                stack.append((True, ("," if position else "") + encode(keys[position]) + ":"))
+            stack.append((True, "{"))
+        elif isinstance(value, list):
+            stack.append((True, "]"))
+            for position in range(len(value) - 1, -1, -1):
+                stack.append((False, value[position]))
+                if position:
+                    stack.append((True, ","))
+            stack.append((True, "["))
+        else:
+            parts.append(encode(value))
+    return hashlib.sha256("".join(parts).encode("utf-8")).hexdigest()
+
+
+def make_request(
+    url: str,
+    api_key: str,
+    timeout: float = REQUEST_TIMEOUT,
+    deadline: float = None
+) -> Optional[dict]:
+    """Make an authenticated GET request to the Lyzr API (see upstream_request for deadline)."""
+    headers = {"x-api-key": api_key, **JSON_HEADERS}
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            return json.loads(response.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        print(f"HTTP Error {e.code} for {url}: {e.reason}")
+        status, reason, data = upstream_request(
+            "GET", url, headers, timeout=timeout, idempotent=True, deadline=deadline
+        )
+    except (OSError, http.client.HTTPException) as e:
+        print(f"URL Error for {url}: {e}")
         return None
-    except urllib.error.URLError as e:
-        print(f"URL Error for {url}: {e.reason}")
+
+    if status >= 400:
+        print(f"HTTP Error {status} for {url}: {reason}")
         return None
+
+    try:
+        return json.loads(data.decode("utf-8"))
     except Exception as e:
         print(f"Error fetching {url}: {str(e)}")
         return None
 
 
-def fetch_agent(agent_id: str, api_key: str) -> Optional[dict]:
-    """Fetch a single agent's configuration."""
+def fetch_agent(
+    agent_id: str,
+    api_key: str,
+    use_cache: bool = True,
+    timeout: float = REQUEST_TIMEOUT,
+    deadline: float = None
+) -> Optional[dict]:
+    """
+    Fetch a single agent's configuration.
+
+    Successful fetches are cached in AGENT_CACHE. With use_cache=False the
+    cache is bypassed for the read and refreshed with the fetched config.
+    Retries stop at the deadline, if given.
+    """
+    cache_key = agent_cache_key(agent_id, api_key)
+    if use_cache:
+        cached = AGENT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
     url = f"{BASE_URL}/v3/agents/{agent_id}"
-    return make_request(url, api_key)
+    agent = make_request(url, api_key, timeout, deadline)
+    if agent:
+        AGENT_CACHE.set(cache_key, agent)
+    return agent
 
 
-def fetch_tool(tool_id: str, api_key: str) -> Optional[dict]:
-    """Fetch a single tool's configuration."""
+def fetch_tool(tool_id: str, api_key: str, deadline: float = None) -> Optional[dict]:
+    """Fetch a single tool's configuration. Retries stop at the deadline, if given."""
     url = f"{BASE_URL}/v3/tools/{tool_id}"
-    return make_request(url, api_key)
+    return make_request(url, api_key, deadline=deadline)
 
 
-def fetch_all_tools(api_key: str) -> list:
-    """Fetch all tools for the API key."""
+def iter_json_array(chunks, key: str = None):
+    """
+    Yield the elements of a JSON array read from an iterable of byte chunks.
+
+    The array is either the top-level value or, when key is given, that key's
+    value in a top-level object (keys of nested objects are not matched).
+    Each element is parsed with json.JSONDecoder.raw_decode once enough of
+    it has arrived, then dropped from the buffer, so memory holds one
+    element plus read-ahead rather than the whole document. Yields nothing if the array is not found; raises
+    ValueError if the input ends mid-array or is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        # Drop the consumed prefix, then read at least as much as is still
+        # buffered, so re-parsing an element that spans many chunks stays
+        # linear in its size
+        nonlocal buffer, pos, eof
+        parts, wanted = [buffer[pos:]], max(1, len(buffer) - pos)
+        pos = 0
+        while wanted > 0 and not eof:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                parts.append(text.decode(b"", final=True))
+            else:
+                part = text.decode(chunk)
+                parts.append(part)
+                wanted -= len(part)
+        buffer = "".join(parts)
+
+    # Find the opening bracket of the array. In a top-level object, walk its
+    # keys and skip every other value whole, so a nested key never matches.
+    state = "start"
+    while True:
+        pos = JSON_WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                if state == "start":
+                    return
+                raise ValueError("JSON object is truncated")
+            fill()
+            continue
+        char = buffer[pos]
+        if state == "start":
+            if char == "[":
+                pos += 1
+                break
+            if char != "{" or not key:
+                return
+            pos += 1
+            state = "key"
+        elif state == "key":
+            if char == "}":
+                return
+            if char == ",":
+                pos += 1
+                continue
+            try:
+                name, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            separator = JSON_KEY_SEPARATOR.match(buffer, end)
+            if not separator:
+                if eof or buffer[end:].strip():
+                    raise ValueError("Expected ':' after an object key")
+                fill()
+                continue
+            pos = separator.end()
+            state = "value" if name == key else "skip"
+        elif state == "value":
+            if char != "[":
+                return
+            pos += 1
+            break
+        else:
+            try:
+                _, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if char not in '{["' and not eof and not JSON_OBJECT_VALUE_END.match(buffer, end):
+                # A number may continue in the next chunk
+                fill()
+                continue
+            pos = end
+            state = "key"
+
+    while True:
+        match = JSON_ARRAY_SEPARATOR.match(buffer, pos)
+        pos = match.end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("JSON array is truncated")
+            fill()
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if buffer[pos] not in '{["' and not eof and not JSON_ARRAY_VALUE_END.match(buffer, end):
+            # A number may continue in the next chunk: "-2." or "1e" parse
+            # as a shorter number until the rest of it arrives
+            fill()
+            continue
+        pos = end
+        yield element
+
+
+def read_chunks(response, size: int):
+    """Yield a response body in chunks of up to size bytes."""
+    while True:
+        chunk = response.read(size)
+        if not chunk:
+            return
+        UPSTREAM_STATS.incr("bytes_received", len(chunk))
+        yield chunk
+
+
+def compact_catalog_tool(tool: dict) -> dict:
+    """
+    Strip a catalog tool down to the fields ToolIndex and extract_tool_summary read.
+
+    The OpenAPI schema keeps its info title and description and, for each
+    path, its methods with only their operationId; parameters, request and
+    response schemas are dropped. The result keeps the catalog tool's shape.
+    """
+    if not isinstance(tool, dict):
+        return tool
+    compact = {"tool_id": tool.get("tool_id"), "name": tool.get("name")}
+    if isinstance(tool.get("tool"), dict):
+        compact["tool"] = {"name": tool["tool"].get("name"), "description": tool["tool"].get("description")}
+    schema = tool.get("schema")
+    if isinstance(schema, dict):
+        info = schema.get("info") or {}
+        paths = {}
+        for path, methods in (schema.get("paths") or {}).items():
+            paths[path] = {
+                method: {"operationId": operation.get("operationId")} if isinstance(operation, dict) else None
+                for method, operation in (methods or {}).items()
+            }
+        compact["schema"] = {
+            "info": {"title": info.get("title"), "description": info.get("description")},
+            "paths": paths,
+        }
+    return compact
+
+
+def stream_tool_catalog(url: str, api_key: str, timeout: float = REQUEST_TIMEOUT) -> list:
+    """
+    GET the tool catalog and reduce each tool with compact_catalog_tool as it
+    is parsed from the stream.
+
+    Goes through the circuit breaker but is not retried; raises OSError,
+    http.client.HTTPException or ValueError so the caller can fall back to a
+    buffered request. Any exception is recorded as a breaker failure, so a
+    half-open trial never goes unrecorded.
+    """
+    breaker = circuit_breaker_for(url)
+    if not breaker.allow():
+        UPSTREAM_STATS.incr("breaker_rejections")
+        raise CircuitOpenError(f"circuit open for {urllib.parse.urlsplit(url).netloc}")
+
+    UPSTREAM_STATS.incr("requests")
+    headers = {"x-api-key": api_key, **JSON_HEADERS}
+    throttled = False
+    try:
+        with HTTP_POOL.stream("GET", url, headers, timeout) as response:
+            if response.status == THROTTLED_STATUS:
+                response.read()
+                throttled = True
+            elif response.status in RETRYABLE_STATUSES:
+                raise http.client.HTTPException(f"HTTP {response.status} {response.reason}")
+            elif response.status >= 400:
+                response.read()
+                breaker.record_success()
+                print(f"HTTP Error {response.status} for {url}: {response.reason}")
+                return []
+            else:
+                tools = [
+                    compact_catalog_tool(tool)
+                    for tool in iter_json_array(read_chunks(response, TOOL_CATALOG_CHUNK_SIZE), "tools")
+                ]
+                # Read the rest of the body so the connection can be reused
+                UPSTREAM_STATS.incr("bytes_received", len(response.read()))
+    except Exception:
+        breaker.record_failure()
+        UPSTREAM_STATS.incr("failures")
+        raise
+    if throttled:
+        breaker.record_throttled()
+        UPSTREAM_STATS.incr("throttled")
+        raise http.client.HTTPException(f"HTTP {THROTTLED_STATUS} Too Many Requests")
+    breaker.record_success()
+    return tools
+
+
+def fetch_all_tools(api_key: str, deadline: float = None) -> list:
+    """
+    Fetch all tools for the API key, reduced with compact_catalog_tool.
+
+    With TOOL_CATALOG_STREAM the catalog is parsed as it streams in; if that
+    fails it is fetched again with a buffered, retried request. With a
+    deadline, timeouts are cut to the time left (at least 1 second) and
+    retries stop at the deadline.
+    """
     url = f"{BASE_URL}/v3/tools/"
-    result = make_request(url, api_key)
+    if TOOL_CATALOG_STREAM:
+        timeout = REQUEST_TIMEOUT
+        if deadline is not None:
+            timeout = min(REQUEST_TIMEOUT, max(1.0, deadline - time.monotonic()))
+        try:
+            return stream_tool_catalog(url, api_key, timeout)
+        except CircuitOpenError as e:
+            print(f"URL Error for {url}: {e}")
+            return []
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            print(f"Streaming tool catalog failed ({e}); retrying with a buffered request")
+
+    result = make_request(url, api_key, deadline=deadline)
     if result and "tools" in result:
-        return result["tools"]
-    return result if isinstance(result, list) else []
+        tools = result["tools"]
+    else:
+        tools = result if isinstance(result, list) else []
+    return [compact_catalog_tool(tool) for tool in tools]
 
 
 def extract_agent_summary(agent: dict) -> dict:
@@ -72,8 +1266,150 @@ def extract_agent_summary(agent: dict) -> dict:
     }
 
 
-def extract_tool_summary(tool_config: dict, all_tools: dict) -> dict:
-    """Extract key fields from a tool config."""
+class ToolIndex:
+    """
+    Tool catalog indexed for lookup by tool id, id suffix, name and action name.
+
+    Tool ids look like "<prefix>-<name>"; the part after the first hyphen is
+    the id suffix. Action names are the operationIds of the tool's OpenAPI
+    schema.
+    """
+
+    def __init__(self, tools: list = None):
+        self._lock = threading.Lock()
+        self.by_id = {}
+        self.by_suffix = {}
+        self.by_name = {}
+        self.by_action = {}
+        for tool in tools or []:
+            self.add(tool)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def add(self, tool: dict):
+        """Index a catalog tool under all its keys."""
+        if not isinstance(tool, dict):
+            return
+        tool_id = tool.get("tool_id") or ""
+        schema = tool.get("schema") or {}
+        name = tool.get("name") or (tool.get("tool") or {}).get("name") or schema.get("info", {}).get("title")
+
+        with self._lock:
+            if tool_id:
+                self.by_id[tool_id] = tool
+                if "-" in tool_id:
+                    self.by_suffix.setdefault(tool_id.split("-", 1)[1], tool)
+            if name:
+                self.by_name.setdefault(name, tool)
+            for methods in (schema.get("paths") or {}).values():
+                for operation in (methods or {}).values():
+                    if isinstance(operation, dict) and operation.get("operationId"):
+                        self.by_action.setdefault(operation["operationId"], tool)
+
+    def lookup(self, tool_config: dict) -> Optional[dict]:
+        """Find the catalog tool for an agent tool config, or None."""
+        tool_name = tool_config.get("tool_name") or ""
+        tool_id = tool_config.get("tool_id") or ""
+        with self._lock:
+            for key, index in (
+                (tool_id, self.by_id),
+                (tool_name, self.by_id),
+                (tool_name, self.by_suffix),
+                (tool_name, self.by_name),
+            ):
+                if key and key in index:
+                    return index[key]
+            for action_name in tool_config.get("action_names") or []:
+                if action_name in self.by_action:
+                    return self.by_action[action_name]
+        return None
+
+    def stats(self) -> dict:
+        return {"mode": "full", "tools_indexed": len(self)}
+
+
+class LazyToolIndex(ToolIndex):
+    """
+    Tool index that fetches only the tools an agent tree references.
+
+    Instead of downloading the full catalog, each referenced tool is fetched
+    with fetch_tool the first time it is looked up. Fetches are memoized for
+    the lifetime of the index (one invocation, or one API key in a batch).
+    No fetch is started once the deadline (if any) has passed; those tools
+    stay unresolved.
+
+    Only id-form references are fetched. Unlike the full catalog, the lazy
+    index cannot match id suffixes, tool names or action names, and
+    custom_api tools are never in /v3/tools/, so those configs are skipped
+    (counted as tools_skipped) rather than sent as GETs that fail.
+    """
+
+    def __init__(self, api_key: str, deadline: float = None):
+        super().__init__()
+        self.api_key = api_key
+        self.deadline = deadline
+        self._requested = {}
+        self._skipped = set()
+        self._request_lock = threading.Lock()
+
+    @staticmethod
+    def tool_ref(tool_config: dict) -> str:
+        """The tool id to fetch for an agent tool config, or "" if it has none."""
+        if tool_config.get("tool_id"):
+            return tool_config["tool_id"]
+        tool_name = tool_config.get("tool_name") or ""
+        if tool_config.get("tool_source") == "custom_api" or not TOOL_ID_PATTERN.fullmatch(tool_name):
+            return ""
+        return tool_name
+
+    def _fetch(self, tool_ref: str):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return
+        tool = fetch_tool(tool_ref, self.api_key, self.deadline)
+        if isinstance(tool, dict):
+            tool.setdefault("tool_id", tool_ref)
+            self.add(compact_catalog_tool(tool))
+
+    def prefetch(self, tool_configs: list, executor: ThreadPoolExecutor = None):
+        """Fetch every not-yet-requested tool referenced by tool_configs, in parallel."""
+        refs = []
+        with self._request_lock:
+            for tool_config in tool_configs:
+                tool_ref = self.tool_ref(tool_config)
+                if not tool_ref:
+                    self._skipped.add(tool_config.get("tool_name") or "")
+                elif tool_ref not in self._requested:
+                    self._requested[tool_ref] = True
+                    refs.append(tool_ref)
+        if executor and len(refs) > 1:
+            list(executor.map(self._fetch, refs))
+        else:
+            for tool_ref in refs:
+                self._fetch(tool_ref)
+
+    def lookup(self, tool_config: dict) -> Optional[dict]:
+        tool = super().lookup(tool_config)
+        if tool is None:
+            self.prefetch([tool_config])
+            tool = super().lookup(tool_config)
+        return tool
+
+    def stats(self) -> dict:
+        return {
+            "mode": "lazy",
+            "tools_indexed": len(self),
+            "tools_fetched": len(self._requested),
+            "tools_skipped": len(self._skipped),
+        }
+
+
+def extract_tool_summary(tool_config: dict, all_tools) -> dict:
+    """
+    Extract key fields from a tool config.
+
+    all_tools is a ToolIndex, or a dict keyed by tool name.
+    """
     tool_name = tool_config.get("tool_name", "")
     tool_source = tool_config.get("tool_source", "")
 
@@ -84,47 +1420,28 @@ def extract_tool_summary(tool_config: dict, all_tools: dict) -> dict:
     }
 
     # Try to find full tool details from all_tools
-    if tool_name in all_tools:
-        full_tool = all_tools[tool_name]
-        if isinstance(full_tool, dict):
-            summary["tool_id"] = full_tool.get("tool_id")
-            if "schema" in full_tool:
-                schema = full_tool["schema"]
-                summary["api_title"] = schema.get("info", {}).get("title")
-                summary["api_description"] = schema.get("info", {}).get("description")
-                # Count endpoints
-                paths = schema.get("paths", {})
-                endpoint_count = sum(len(methods) for methods in paths.values())
-                summary["endpoint_count"] = endpoint_count
-            if "tool" in full_tool:
-                summary["tool_description"] = full_tool["tool"].get("description")
+    if isinstance(all_tools, ToolIndex):
+        full_tool = all_tools.lookup(tool_config)
+    else:
+        full_tool = all_tools.get(tool_name)
+    if isinstance(full_tool, dict):
+        summary["tool_id"] = full_tool.get("tool_id")
+        if "schema" in full_tool:
+            schema = full_tool["schema"]
+            summary["api_title"] = schema.get("info", {}).get("title")
+            summary["api_description"] = schema.get("info", {}).get("description")
+            # Count endpoints
+            paths = schema.get("paths", {})
+            endpoint_count = sum(len(methods) for methods in paths.values())
+            summary["endpoint_count"] = endpoint_count
+        if "tool" in full_tool:
+            summary["tool_description"] = full_tool["tool"].get("description")
 
     return summary
 
 
-def fetch_agent_tree(
-    agent_id: str,
-    api_key: str,
-    all_tools: dict,
-    visited: set = None,
-    depth: int = 0
-) -> Optional[dict]:
-    """Recursively fetch an agent and all its sub-agents."""
-    if visited is None:
-        visited = set()
-
-    # Prevent infinite loops
-    if agent_id in visited:
-        return {"id": agent_id, "error": "circular_reference", "depth": depth}
-
-    visited.add(agent_id)
-
-    # Fetch the agent
-    agent = fetch_agent(agent_id, api_key)
-    if not agent:
-        return {"id": agent_id, "error": "fetch_failed", "depth": depth}
-
-    # Build the tree node
+def build_agent_node(agent: dict, all_tools, depth: int) -> dict:
+    """Build a tree node (without sub-agents) from a fetched agent."""
     node = {
         "agent": extract_agent_summary(agent),
         "depth": depth,
@@ -154,26 +1471,160 @@ def fetch_agent_tree(
                 "tool_source": "direct_string",
             })
 
-    # Recursively fetch managed agents (sub-agents)
-    managed_agents = agent.get("managed_agents") or []
-    for sub_agent_ref in managed_agents:
+    return node
+
+
+def get_sub_agent_refs(agent: dict) -> list:
+    """Return (sub_agent_id, reference) pairs for an agent's managed agents."""
+    refs = []
+    for sub_agent_ref in agent.get("managed_agents") or []:
         sub_agent_id = sub_agent_ref.get("id") if isinstance(sub_agent_ref, dict) else sub_agent_ref
         if sub_agent_id:
-            sub_tree = fetch_agent_tree(
-                sub_agent_id,
-                api_key,
-                all_tools,
-                visited.copy(),  # Use copy to allow same agent in different branches
-                depth + 1
-            )
-            if sub_tree:
-                # Add usage description from parent reference
-                if isinstance(sub_agent_ref, dict):
-                    sub_tree["usage_description"] = sub_agent_ref.get("usage_description")
-                    sub_tree["reference_name"] = sub_agent_ref.get("name")
-                node["sub_agents"].append(sub_tree)
+            refs.append((sub_agent_id, sub_agent_ref))
+    return refs
 
-    return node
+
+def truncated_node(agent_id: str, depth: int, reason: str) -> dict:
+    """Placeholder for a sub-agent that was not fetched because of a fetch limit."""
+    return {
+        "id": agent_id,
+        "error": "truncated",
+        "truncated": True,
+        "truncated_reason": reason,
+        "depth": depth,
+    }
+
+
+def fetch_agent_tree(
+    agent_id: str,
+    api_key: str,
+    all_tools,
+    visited: set = None,
+    depth: int = 0,
+    max_workers: int = None,
+    use_cache: bool = True,
+    deadline: float = None,
+    max_agents: int = None,
+    max_depth: int = None,
+    timings: Timings = None
+) -> Optional[dict]:
+    """
+    Fetch an agent and all its sub-agents.
+
+    The tree is fetched level by level: all siblings at one depth are fetched
+    in parallel (at most max_workers requests in flight), so a tree costs
+    roughly one round trip per level. Child order and depth values are the
+    same as a depth-first walk. The same agent may appear in different
+    branches; it is only reported as a circular_reference when it is one of
+    its own ancestors.
+
+    Each unique agent id is fetched at most once per call, and the result is
+    fanned out to every parent that references it, so shared sub-agents cost
+    one request no matter how many paths lead to them.
+
+    The fetch is bounded by an optional deadline (a time.monotonic() value),
+    max_agents (unique agents fetched) and max_depth (levels below the root).
+    The root is always fetched. Nodes that are cut off are returned as
+    {"error": "truncated", "truncated": true, "truncated_reason": ...} with
+    the reason "deadline", "max_agents" or "max_depth".
+
+    With timings, the duration of every agent fetch is recorded by agent id.
+    """
+    if max_workers is None:
+        max_workers = FETCH_MAX_WORKERS
+    max_workers = max(1, max_workers)
+
+    # Each pending entry: (agent_id, parent reference, ancestors, depth, parent sub_agents list)
+    root_holder = []
+    level = [(agent_id, None, set(visited or ()), depth, root_holder)]
+    fetched = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        while level:
+            now = time.monotonic()
+            past_deadline = deadline is not None and now >= deadline and bool(root_holder)
+            timeout = min(REQUEST_TIMEOUT, max(1.0, deadline - now)) if deadline is not None else REQUEST_TIMEOUT
+
+            truncated = {}
+            to_fetch = []
+            for index, (node_id, _, ancestors, node_depth, _) in enumerate(level):
+                if node_id in ancestors:
+                    continue
+                if max_depth is not None and node_depth - depth > max_depth:
+                    truncated[index] = "max_depth"
+                elif past_deadline:
+                    truncated[index] = "deadline"
+                elif node_id not in fetched:
+                    if max_agents is not None and len(fetched) >= max_agents:
+                        truncated[index] = "max_agents"
+                    else:
+                        fetched[node_id] = None
+                        to_fetch.append(node_id)
+
+            def fetch_one(sub_agent_id: str) -> Optional[dict]:
+                started = time.monotonic()
+                agent = fetch_agent(sub_agent_id, api_key, use_cache, timeout, deadline)
+                if timings is not None:
+                    timings.add_agent(sub_agent_id, time.monotonic() - started)
+                return agent
+
+            if executor and len(to_fetch) > 1:
+                agents = list(executor.map(fetch_one, to_fetch))
+            else:
+                agents = [fetch_one(sub_agent_id) for sub_agent_id in to_fetch]
+            fetched.update(zip(to_fetch, agents))
+            deadline_hit = deadline is not None and time.monotonic() >= deadline
+
+            # Fetch the tools this level references before building its nodes
+            if isinstance(all_tools, LazyToolIndex):
+                level_tool_configs = []
+                for agent in agents:
+                    if agent:
+                        level_tool_configs.extend(agent.get("tool_configs") or [])
+                all_tools.prefetch(level_tool_configs, executor)
+
+            next_level = []
+            for index, (node_id, ref, ancestors, node_depth, siblings) in enumerate(level):
+                agent = None
+                # Prevent infinite loops
+                if node_id in ancestors:
+                    node = {"id": node_id, "error": "circular_reference", "depth": node_depth}
+                elif index in truncated:
+                    node = truncated_node(node_id, node_depth, truncated[index])
+                else:
+                    agent = fetched[node_id]
+                    if agent:
+                        node = build_agent_node(agent, all_tools, node_depth)
+                    elif deadline_hit:
+                        # The request was cut short by the deadline timeout
+                        node = truncated_node(node_id, node_depth, "deadline")
+                    else:
+                        node = {"id": node_id, "error": "fetch_failed", "depth": node_depth}
+
+                # Add usage description from parent reference
+                if isinstance(ref, dict):
+                    node["usage_description"] = ref.get("usage_description")
+                    node["reference_name"] = ref.get("name")
+                siblings.append(node)
+
+                if agent:
+                    child_ancestors = ancestors | {node_id}
+                    for sub_agent_id, sub_agent_ref in get_sub_agent_refs(agent):
+                        next_level.append((
+                            sub_agent_id,
+                            sub_agent_ref,
+                            child_ancestors,
+                            node_depth + 1,
+                            node["sub_agents"]
+                        ))
+
+            level = next_level
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return root_holder[0] if root_holder else None
 
 
 def build_statistics(tree: dict) -> dict:
@@ -227,225 +1678,1882 @@ def build_statistics(tree: dict) -> dict:
     return stats
 
 
-def score_agent_tree(agent_tree: dict, scoring_api_key: str = None) -> dict:
-    """Send agent tree to the scoring agent and get the score breakdown."""
-    api_key = scoring_api_key or SCORING_AGENT_API_KEY
+def analyze_tree(tree: dict) -> dict:
+    """
+    Walk the tree once and build the statistics, display text and the list
+    of truncated nodes.
+
+    Uses an explicit stack instead of recursion, so deep trees cannot hit the
+    recursion limit, and writes the display lines into a single buffer.
+    statistics and display_tree are identical to build_statistics and
+    format_tree_display. truncated lists the nodes cut off by a fetch limit
+    as {id, depth, reason} entries, root first.
+    """
+    total_agents = 0
+    total_tools = 0
+    max_depth = 0
+    agents_with_tools = 0
+    agents_without_instructions = 0
+    total_instruction_chars = 0
+    models_used = set()
+    providers_used = set()
+    tool_sources = set()
+    truncated = []
+
+    display = io.StringIO()
+    write = display.write
+
+    # Stack entries: (node, indent, counted in statistics)
+    stack = [(tree, "", True)] if tree else []
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, indent, counted = pop()
+        if not node:
+            # format_tree_display renders an empty sub-agent as an empty line
+            write("\n")
+            continue
 
-    scoring_request = {
-        "agent_id": SCORING_AGENT_ID,
-        "session_id": str(uuid.uuid4()),
-        "message": "Score this agent configuration:\n\n" + json.dumps(agent_tree, indent=2)
-    }
+        agent = node.get("agent", {})
+        tools = node.get("tools", [])
+        sub_agents = node.get("sub_agents", [])
+        counted = counted and "error" not in node
+        if node.get("truncated"):
+            truncated.append({"id": node.get("id"), "depth": node.get("depth"), "reason": node.get("truncated_reason")})
+
+        # Statistics
+        if counted:
+            total_agents += 1
+            depth = node.get("depth", 0)
+            if depth > max_depth:
+                max_depth = depth
+            if agent.get("model"):
+                models_used.add(agent["model"])
+            if agent.get("provider"):
+                providers_used.add(agent["provider"])
+            if not agent.get("has_instructions"):
+                agents_without_instructions += 1
+            total_instruction_chars += agent.get("instruction_length", 0)
+            total_tools += len(tools)
+            if tools:
+                agents_with_tools += 1
+            for tool in tools:
+                if tool.get("tool_source"):
+                    tool_sources.add(tool["tool_source"])
+
+        # Display
+        write(f"{indent}[Agent] {agent.get('name', 'Unknown')}\n")
+        write(f"{indent}  Model: {agent.get('model', 'N/A')}\n")
+        write(f"{indent}  ID: {agent.get('id', 'N/A')}\n")
+
+        if agent.get("role"):
+            role = agent["role"][:100] + "..." if len(agent.get("role", "")) > 100 else agent.get("role", "")
+            write(f"{indent}  Role: {role}\n")
 
-    req = urllib.request.Request(
-        f"{BASE_URL}/v3/inference/chat/",
-        data=json.dumps(scoring_request).encode("utf-8"),
-        headers={
-            "x-api-key": api_key,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        },
-        method="POST"
-    )
+        if tools:
+            write(f"{indent}  Tools ({len(tools)}):\n")
+            for tool in tools:
+                write(f"{indent}    - {tool.get('tool_name', 'Unknown')} ({tool.get('tool_source', '')})\n")
 
-    try:
-        with urllib.request.urlopen(req, timeout=120) as response:
-            result = json.loads(response.read().decode("utf-8"))
+        if sub_agents:
+            write(f"{indent}  Sub-Agents ({len(sub_agents)}):\n")
+            child_indent = indent + "    "
+            for sub in reversed(sub_agents):
+                push((sub, child_indent, counted))
 
-            # Parse the scoring response
-            response_text = result.get("response", "")
+    # Every line was written with a trailing newline; drop the last one
+    display_tree = display.getvalue()[:-1]
 
-            # Try to extract JSON from the response
-            try:
-                # The response might be a JSON string
-                score_data = json.loads(response_text)
-                return {
-                    "success": True,
-                    "score": score_data.get("aggregated", {}).get("mean_score"),
-                    "summary": score_data.get("aggregated", {}).get("summary"),
-                    "breakdown": score_data
-                }
-            except json.JSONDecodeError:
-                # If not valid JSON, return the raw response
-                return {
-                    "success": True,
-                    "raw_response": response_text
-                }
-
-    except urllib.error.HTTPError as e:
-        print(f"Scoring HTTP Error {e.code}: {e.reason}")
-        return {"success": False, "error": f"HTTP {e.code}: {e.reason}"}
-    except urllib.error.URLError as e:
-        print(f"Scoring URL Error: {e.reason}")
-        return {"success": False, "error": str(e.reason)}
-    except Exception as e:
-        print(f"Scoring Error: {str(e)}")
-        return {"success": False, "error": str(e)}
+    return {
+        "statistics": {
+            "total_agents": total_agents,
+            "total_tools": total_tools,
+            "max_depth": max_depth,
+            "models_used": list(models_used),
+            "providers_used": list(providers_used),
+            "agents_with_tools": agents_with_tools,
+            "agents_without_instructions": agents_without_instructions,
+            "total_instruction_chars": total_instruction_chars,
+            "tool_sources": list(tool_sources),
+        },
+        "display_tree": display_tree,
+        "truncated": truncated,
+    }
 
 
-def format_tree_display(tree: dict, indent: str = "") -> str:
-    """Format the tree for human-readable display."""
-    if not tree:
-        return ""
+def iter_agent_nodes(tree: dict):
+    """Yield every successfully fetched node of the tree, root first."""
+    stack = [tree] if tree else []
+    while stack:
+        node = stack.pop()
+        if not node or "error" in node:
+            continue
+        yield node
+        stack.extend(reversed(node.get("sub_agents", [])))
+
+
+def has_knowledge_base(node: dict) -> bool:
+    """Return True if the node's agent has a knowledge base feature attached."""
+    features = node.get("agent", {}).get("features") or []
+    return any(isinstance(f, dict) and f.get("type") == "KNOWLEDGE_BASE" for f in features)
+
+
+def score_architecture(tree: dict) -> tuple:
+    """Step 1: manager + specialists with clear roles and routing."""
+    specialists = [sub for sub in tree.get("sub_agents", []) if "error" not in sub]
+    if not specialists:
+        return TSHIRT_POINTS["XS"], "Single agent only; add a manager with specialist sub-agents."
+
+    if any(not sub.get("agent", {}).get("role") for sub in specialists):
+        return TSHIRT_POINTS["S"], "Some sub-agents have no role; define a clear role for every specialist."
+    if any(not sub.get("usage_description") for sub in specialists):
+        return TSHIRT_POINTS["M"], "Routing incomplete; add a usage description for every sub-agent."
+
+    roles = {sub["agent"]["role"].strip().lower() for sub in specialists}
+    if len(specialists) >= 2 and len(roles) == len(specialists):
+        return TSHIRT_POINTS["XL"], None
+    if len(specialists) >= 2:
+        return TSHIRT_POINTS["L"], "Specialist roles overlap; give each specialist a distinct domain."
+    return TSHIRT_POINTS["L"], "Only one specialist; add 2 or more specialists with distinct domains."
+
+
+def score_tools(tree: dict) -> tuple:
+    """Step 2: number of tools integrated across the tree."""
+    tool_count = sum(len(node.get("tools", [])) for node in iter_agent_nodes(tree))
+    if tool_count >= 3:
+        return TSHIRT_POINTS["XL"], None
+    if tool_count == 2:
+        return TSHIRT_POINTS["L"], "2 tools integrated; add a third tool."
+    if tool_count == 1:
+        return TSHIRT_POINTS["M"], "1 tool integrated; add 2 more tools."
+    return TSHIRT_POINTS["S"], "No tools integrated; attach 3 or more tools across the agents."
+
+
+def score_knowledge(tree: dict) -> tuple:
+    """Step 3: knowledge base placement (specialists only is ideal)."""
+    on_manager = has_knowledge_base(tree)
+    on_specialist = any(has_knowledge_base(node) for node in iter_agent_nodes(tree) if node is not tree)
+    if on_specialist and not on_manager:
+        return TSHIRT_POINTS["XL"], None
+    if on_specialist:
+        return TSHIRT_POINTS["L"], "KB is on the manager and specialists; keep it on specialists only."
+    if on_manager:
+        return TSHIRT_POINTS["M"], "KB is only on the manager; move it to the specialist that needs it."
+    return TSHIRT_POINTS["S"], "No knowledge base attached; attach one to a specialist."
+
+
+def score_quality(tree: dict) -> tuple:
+    """Step 4: number of unique specialists covering the workflows."""
+    specialist_ids = {
+        node.get("agent", {}).get("id")
+        for node in iter_agent_nodes(tree)
+        if node is not tree
+    }
+    count = len(specialist_ids)
+    if count >= 3:
+        return TSHIRT_POINTS["XL"], None
+    if count == 2:
+        return TSHIRT_POINTS["L"], "2 specialists; add a third to cover orders, returns and product info."
+    if count == 1:
+        return TSHIRT_POINTS["M"], "1 specialist covers one scenario; add specialists for the other flows."
+    return TSHIRT_POINTS["S"], "No specialists; the workflow cannot run end-to-end."
 
-    lines = []
-    agent = tree.get("agent", {})
 
-    # Agent header
-    name = agent.get("name", "Unknown")
-    model = agent.get("model", "N/A")
-    lines.append(f"{indent}[Agent] {name}")
-    lines.append(f"{indent}  Model: {model}")
-    lines.append(f"{indent}  ID: {agent.get('id', 'N/A')}")
+def total_score(categories: dict) -> int:
+    """Sum the category scores that are present."""
+    return sum(points for points in categories.values() if isinstance(points, (int, float)))
 
-    if agent.get("role"):
-        role = agent["role"][:100] + "..." if len(agent.get("role", "")) > 100 else agent.get("role", "")
-        lines.append(f"{indent}  Role: {role}")
 
-    # Tools
-    tools = tree.get("tools", [])
-    if tools:
-        lines.append(f"{indent}  Tools ({len(tools)}):")
-        for tool in tools:
-            tool_name = tool.get("tool_name", "Unknown")
-            source = tool.get("tool_source", "")
-            lines.append(f"{indent}    - {tool_name} ({source})")
+def score_agent_tree_locally(agent_tree: dict) -> dict:
+    """
+    Score the architecture, tools, knowledge and quality categories in-process.
 
-    # Sub-agents
-    sub_agents = tree.get("sub_agents", [])
-    if sub_agents:
-        lines.append(f"{indent}  Sub-Agents ({len(sub_agents)}):")
-        for sub in sub_agents:
-            sub_display = format_tree_display(sub, indent + "    ")
-            lines.append(sub_display)
+    Applies the counting rules from the scoring metrics rubric directly to the
+    fetched tree, so results are deterministic. Prompt quality is not scored
+    locally and is returned as None. The result has the same shape as
+    score_agent_tree.
+    """
+    scorers = {
+        "architecture": score_architecture,
+        "tools": score_tools,
+        "knowledge": score_knowledge,
+        "quality": score_quality,
+    }
 
-    return "\n".join(lines)
+    categories = {}
+    notes = []
+    for category, scorer in scorers.items():
+        points, note = scorer(agent_tree)
+        categories[category] = points
+        if note:
+            notes.append(f"{category}: {note}")
+    categories["prompts"] = None
 
+    score = total_score(categories)
+    return {
+        "success": True,
+        "score": score,
+        "summary": f"Local score {score}/{len(LOCAL_SCORE_CATEGORIES) * TSHIRT_POINTS['XL']}",
+        "breakdown": {
+            "score": score,
+            "breakdown": categories,
+            "debug": " ".join(notes) or "All rule-based criteria satisfied.",
+        }
+    }
 
-def lambda_handler(event, context):
-    """
-    Lambda handler to recursively fetch agent configurations and score them.
 
-    Expected input (via event body or query parameters):
-    - agent_id: The root agent ID to start from
-    - api_key: The Lyzr API key for authentication
-    - skip_scoring: (optional) Set to true to skip scoring
-    - scoring_api_key: (optional) Override the scoring agent API key
+def merge_hybrid_scores(local_result: dict, llm_result: dict) -> dict:
+    """
+    Combine local category scores with the scoring agent's prompt score.
 
-    Returns:
-    - agent_tree: Complete tree of agents and sub-agents with their configs
-    - statistics: Summary statistics about the agent hierarchy
-    - display_tree: Human-readable tree representation
-    - scoring: Score and breakdown from the scoring agent
+    Without a prompt score the result is unsuccessful (with an error), so it
+    is neither cached nor recorded; the local categories are still returned.
     """
-    # Parse input
-    if isinstance(event.get("body"), str):
-        body = json.loads(event.get("body", "{}"))
-    else:
-        body = event.get("body") or event
+    local_breakdown = local_result["breakdown"]
+    categories = dict(local_breakdown["breakdown"])
+
+    llm_breakdown = llm_result.get("breakdown") or {}
+    llm_categories = llm_breakdown.get("breakdown") or {}
+    categories["prompts"] = llm_categories.get("prompts")
+
+    notes = [local_breakdown["debug"]]
+    error = None
+    if not llm_result.get("success"):
+        error = f"scoring agent failed: {llm_result.get('error')}"
+    elif categories["prompts"] is None:
+        error = "scoring agent returned no prompt score"
+    elif llm_breakdown.get("debug"):
+        notes.append(f"prompts: {llm_breakdown['debug']}")
+    if error:
+        notes.append(f"prompts: {error}.")
+
+    score = total_score(categories)
+    result = {
+        "success": error is None,
+        "score": score,
+        "summary": llm_result.get("summary"),
+        "breakdown": {
+            "score": score,
+            "breakdown": categories,
+            "debug": " ".join(notes),
+        }
+    }
+    if error:
+        result["error"] = f"Hybrid scoring has no prompt score ({error})"
+    return result
 
-    # Support both body and query parameters
-    query_params = event.get("queryStringParameters") or {}
 
-    agent_id = body.get("agent_id") or query_params.get("agent_id")
-    api_key = body.get("api_key") or query_params.get("api_key")
-    skip_scoring = body.get("skip_scoring", False) or query_params.get("skip_scoring") == "true"
-    scoring_api_key = body.get("scoring_api_key") or query_params.get("scoring_api_key")
+def compact_tool(tool: dict) -> dict:
+    """Keep the tool fields the rubric uses."""
+    return {
+        "tool_name": tool.get("tool_name"),
+        "tool_source": tool.get("tool_source"),
+        "action_names": tool.get("action_names"),
+        "api_title": tool.get("api_title"),
+        "endpoint_count": tool.get("endpoint_count"),
+        "tool_description": tool.get("tool_description") or tool.get("description"),
+        "api_description": tool.get("api_description"),
+    }
 
-    # Validation
-    if not agent_id:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({"error": "agent_id is required"})
+
+def compact_node(node: dict) -> dict:
+    """Keep the agent fields the rubric uses, collapsing feature blocks to their types."""
+    if "error" in node:
+        return {"id": node.get("id"), "error": node["error"]}
+
+    agent = node.get("agent", {})
+    features = []
+    knowledge_bases = []
+    for feature in agent.get("features") or []:
+        if not isinstance(feature, dict):
+            continue
+        if feature.get("type") and feature["type"] not in features:
+            features.append(feature["type"])
+        if feature.get("type") == "KNOWLEDGE_BASE":
+            rag = (feature.get("config") or {}).get("lyzr_rag") or {}
+            knowledge_bases.append(rag.get("rag_name") or rag.get("rag_id"))
+
+    compact = {
+        "name": agent.get("name"),
+        "role": agent.get("role"),
+        "goal": agent.get("goal"),
+        "description": agent.get("description"),
+        "has_instructions": agent.get("has_instructions"),
+        "instruction_length": agent.get("instruction_length"),
+        "features": features,
+        "knowledge_bases": knowledge_bases,
+        "usage_description": node.get("usage_description"),
+        "tools": [compact_tool(tool) for tool in node.get("tools", [])],
+        "a2a_tools": node.get("a2a_tools"),
+        "sub_agents": [compact_node(sub) for sub in node.get("sub_agents", [])],
+    }
+    if node.get("reference_name") and node["reference_name"] != agent.get("name"):
+        compact["reference_name"] = node["reference_name"]
+    return compact
+
+
+def strip_empty(value):
+    """Recursively drop None, empty strings, empty lists and empty dicts."""
+    if isinstance(value, dict):
+        stripped = {key: strip_empty(item) for key, item in value.items()}
+        return {key: item for key, item in stripped.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [strip_empty(item) for item in value]
+    return value
+
+
+def truncate_field(limit: int):
+    """Return a reducer that shortens a text field to limit characters."""
+    def reduce(item: dict, field: str):
+        text = item.get(field)
+        if isinstance(text, str) and len(text) > limit:
+            item[field] = text[:limit] + "..."
+    return reduce
+
+
+def drop_field(item: dict, field: str):
+    item.pop(field, None)
+
+
+def tool_names(item: dict, field: str):
+    """Replace each tool in the list with its name."""
+    if item.get(field):
+        item[field] = [tool.get("tool_name") if isinstance(tool, dict) else tool for tool in item[field]]
+
+
+# Reductions applied in order, least important first, until the payload fits:
+# (label, "agent" or "tool", field, reducer). Labels are "<field>:<max chars>"
+# or "<field>:dropped".
+PAYLOAD_REDUCTIONS = (
+    ("tools.api_description:dropped", "tool", "api_description", drop_field),
+    ("tools.tool_description:120", "tool", "tool_description", truncate_field(120)),
+    ("agent.description:300", "agent", "description", truncate_field(300)),
+    ("agent.usage_description:300", "agent", "usage_description", truncate_field(300)),
+    ("tools.tool_description:dropped", "tool", "tool_description", drop_field),
+    ("tools.action_names:dropped", "tool", "action_names", drop_field),
+    ("agent.goal:200", "agent", "goal", truncate_field(200)),
+    ("agent.description:120", "agent", "description", truncate_field(120)),
+    ("agent.usage_description:120", "agent", "usage_description", truncate_field(120)),
+    ("agent.a2a_tools:dropped", "agent", "a2a_tools", drop_field),
+    ("agent.role:200", "agent", "role", truncate_field(200)),
+    ("agent.tools:names", "agent", "tools", tool_names),
+    ("agent.description:dropped", "agent", "description", drop_field),
+    ("agent.usage_description:60", "agent", "usage_description", truncate_field(60)),
+    ("agent.goal:60", "agent", "goal", truncate_field(60)),
+    ("agent.role:60", "agent", "role", truncate_field(60)),
+)
+
+# Max tools listed per agent once every reduction and every sub-agent level
+# below the root have been dropped
+PAYLOAD_MAX_TOOLS = 10
+
+
+def drop_deepest_sub_agents(compact: dict) -> Optional[int]:
+    """
+    Remove the deepest level of sub-agents from a compact tree.
+
+    Their parents get a sub_agents_omitted count instead. Returns the depth
+    of the removed level, or None if the tree has no sub-agents.
+    """
+    levels, level = [], [compact]
+    while level:
+        levels.append(level)
+        level = [sub for node in level for sub in node.get("sub_agents", [])]
+    if len(levels) < 2:
+        return None
+    for parent in levels[-2]:
+        if parent.get("sub_agents"):
+            parent["sub_agents_omitted"] = parent.get("sub_agents_omitted", 0) + len(parent.pop("sub_agents"))
+    return len(levels) - 1
+
+
+def build_scoring_payload(agent_tree: dict, max_chars: int = None) -> tuple:
+    """
+    Build a compact JSON payload of the agent tree for the scoring agent.
+
+    Keeps only rubric-relevant fields, drops nulls and empty values, collapses
+    repeated feature blocks to their types, and serializes without
+    indentation. If the result is over max_chars, the reductions in
+    PAYLOAD_REDUCTIONS are applied in order until it fits; after those the
+    deepest sub-agent levels are dropped, then tool lists are cut to
+    PAYLOAD_MAX_TOOLS. Only a root agent too large on its own stays over
+    budget, which stats reports as over_budget.
+
+    Returns (payload, stats) where stats reports the before and after sizes.
+    """
+    if max_chars is None:
+        max_chars = SCORING_PAYLOAD_MAX_CHARS
+
+    compact = strip_empty(compact_node(agent_tree))
+    payload = json.dumps(compact, separators=(",", ":"))
+
+    applied = []
+    for label, target, field, reduce in PAYLOAD_REDUCTIONS:
+        if len(payload) <= max_chars:
+            break
+        for node in iter_agent_nodes(compact):
+            items = node.get("tools", []) if target == "tool" else [node]
+            for item in items:
+                reduce(item, field)
+        applied.append(label)
+        payload = json.dumps(compact, separators=(",", ":"))
+
+    while len(payload) > max_chars:
+        depth = drop_deepest_sub_agents(compact)
+        if depth is None:
+            break
+        applied.append(f"sub_agents.depth{depth}:dropped")
+        payload = json.dumps(compact, separators=(",", ":"))
+
+    if len(payload) > max_chars and len(compact.get("tools", [])) > PAYLOAD_MAX_TOOLS:
+        compact["tools_omitted"] = len(compact["tools"]) - PAYLOAD_MAX_TOOLS
+        compact["tools"] = compact["tools"][:PAYLOAD_MAX_TOOLS]
+        applied.append(f"agent.tools:{PAYLOAD_MAX_TOOLS}")
+        payload = json.dumps(compact, separators=(",", ":"))
+
+    original_chars = len(json.dumps(agent_tree, indent=2))
+    stats = {
+        "original_chars": original_chars,
+        "compact_chars": len(payload),
+        "estimated_tokens": len(payload) // CHARS_PER_TOKEN,
+        "original_estimated_tokens": original_chars // CHARS_PER_TOKEN,
+        "max_chars": max_chars,
+        "truncated": applied,
+        "over_budget": len(payload) > max_chars,
+    }
+    return payload, stats
+
+
+def score_agent_tree(
+    agent_tree: dict,
+    scoring_api_key: str = None,
+    instruction: str = "Score this agent configuration:",
+    payload: str = None
+) -> dict:
+    """
+    Send agent tree to the scoring agent and get the score breakdown.
+
+    payload overrides the serialized tree (see build_scoring_payload).
+    """
+    import uuid
+
+    api_key = scoring_api_key or SCORING_AGENT_API_KEY
+    if payload is None:
+        payload = json.dumps(agent_tree, indent=2)
+
+    scoring_request = {
+        "agent_id": SCORING_AGENT_ID,
+        "session_id": str(uuid.uuid4()),
+        "message": instruction + "\n\n" + payload
+    }
+
+    headers = {"x-api-key": api_key, **JSON_HEADERS}
+
+    try:
+        status, reason, data = upstream_request(
+            "POST",
+            f"{BASE_URL}/v3/inference/chat/",
+            headers,
+            body=json.dumps(scoring_request).encode("utf-8"),
+            timeout=120
+        )
+        if status >= 400:
+            print(f"Scoring HTTP Error {status}: {reason}")
+            return {"success": False, "error": f"HTTP {status}: {reason}"}
+
+        result = json.loads(data.decode("utf-8"))
+
+        # Parse the scoring response
+        response_text = result.get("response", "")
+
+        # Try to extract JSON from the response
+        try:
+            # The response might be a JSON string
+            score_data = json.loads(response_text)
+            return {
+                "success": True,
+                "score": score_data.get("aggregated", {}).get("mean_score"),
+                "summary": score_data.get("aggregated", {}).get("summary"),
+                "breakdown": score_data
+            }
+        except json.JSONDecodeError:
+            # If not valid JSON, return the raw response
+            return {
+                "success": True,
+                "raw_response": response_text
+            }
+
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Scoring URL Error: {e}")
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        print(f"Scoring Error: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def score_categories(result: dict) -> Optional[dict]:
+    """Return the per-category scores of a scoring result, or None if it has none."""
+    if not result or not result.get("success"):
+        return None
+    breakdown = result.get("breakdown") or {}
+    inner_breakdown = breakdown.get("breakdown")
+    if not isinstance(inner_breakdown, dict):
+        return None
+    return {category: inner_breakdown.get(category) for category in SCORE_CATEGORIES}
+
+
+def aggregate_samples(results: list, requested: int, early_stop: bool) -> dict:
+    """Combine successful scoring samples into per-category medians and spreads."""
+    import statistics
+
+    sampled = [(result, score_categories(result)) for result in results]
+    sampled = [(result, categories) for result, categories in sampled if categories]
+    if not sampled:
+        failure = next((r for r in results if not r.get("success")), None)
+        return failure or {"success": False, "error": f"All {requested} scoring samples failed"}
+
+    medians = {}
+    spread = {}
+    for category in SCORE_CATEGORIES:
+        values = [categories[category] for _, categories in sampled if isinstance(categories[category], (int, float))]
+        # Lower median keeps the result on the rubric's point scale
+        medians[category] = statistics.median_low(values) if values else None
+        spread[category] = max(values) - min(values) if values else None
+
+    # Report the rationale of the sample closest to the median total
+    score = total_score(medians)
+    closest, _ = min(sampled, key=lambda item: abs(total_score(item[1]) - score))
+    closest_breakdown = closest.get("breakdown") or {}
+
+    return {
+        "success": True,
+        "score": score,
+        "summary": closest.get("summary"),
+        "breakdown": {
+            "score": score,
+            "breakdown": medians,
+            "debug": closest_breakdown.get("debug") or (closest_breakdown.get("breakdown") or {}).get("debug"),
+        },
+        "samples": {
+            "requested": requested,
+            "completed": len(results),
+            "succeeded": len(sampled),
+            "early_stop": early_stop,
+            "scores": [total_score(categories) for _, categories in sampled],
+            "spread": spread,
         }
+    }
 
-    if not api_key:
+
+def score_agent_tree_sampled(
+    agent_tree: dict,
+    scoring_api_key: str = None,
+    samples: int = 1,
+    agree: int = None,
+    **kwargs
+) -> dict:
+    """
+    Score the tree with several concurrent scoring calls and aggregate them.
+
+    Returns the median per category and the spread across samples. Once
+    agree successful samples return identical breakdowns, the remaining calls
+    are cancelled or ignored. Extra keyword arguments go to score_agent_tree.
+    """
+    if samples <= 1:
+        return score_agent_tree(agent_tree, scoring_api_key, **kwargs)
+    agree = max(1, agree or SCORING_AGREE_K)
+
+    executor = ThreadPoolExecutor(max_workers=samples)
+    futures = [
+        executor.submit(score_agent_tree, agent_tree, scoring_api_key, **kwargs)
+        for _ in range(samples)
+    ]
+    results = []
+    agreement = {}
+    early_stop = False
+    try:
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            categories = score_categories(result)
+            if categories is None:
+                continue
+            key = tuple(categories[category] for category in SCORE_CATEGORIES)
+            agreement[key] = agreement.get(key, 0) + 1
+            if agreement[key] >= agree and len(results) < samples:
+                early_stop = True
+                break
+    finally:
+        # Don't wait for outstanding samples once we have an answer
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return aggregate_samples(results, samples, early_stop)
+
+
+def unique_agent_nodes(agent_tree: dict) -> list:
+    """
+    Fetched nodes of the tree, once per agent id, root first.
+
+    Returns (node, parent node) pairs; the parent is None for the root and
+    is the first parent found for agents shared by several parents.
+    """
+    nodes = {}
+    stack = [(agent_tree, None)] if agent_tree else []
+    while stack:
+        node, parent = stack.pop()
+        if not node or "error" in node:
+            continue
+        nodes.setdefault(node["agent"].get("id"), (node, parent))
+        stack.extend((sub, node) for sub in reversed(node.get("sub_agents", [])))
+    return list(nodes.values())
+
+
+def agent_context(node: dict) -> dict:
+    """One-line summary of a parent or sub-agent for per-agent scoring context."""
+    if "error" in node:
+        return {"id": node.get("id"), "error": node["error"]}
+    agent = node.get("agent", {})
+    return {
+        "name": agent.get("name"),
+        "role": agent.get("role"),
+        "usage_description": node.get("usage_description"),
+        "tool_count": len(node.get("tools", [])),
+        "has_knowledge_base": has_knowledge_base(node),
+        "sub_agent_count": len(node.get("sub_agents", [])),
+    }
+
+
+def agent_scoring_payload(node: dict, parent: dict = None) -> str:
+    """
+    Compact JSON of a single agent for per-agent scoring.
+
+    The agent's own fields are kept as in the tree payload; its parent and
+    direct sub-agents are reduced to agent_context summaries, so the scoring
+    agent can judge routing and knowledge base placement without the full
+    subtree.
+    """
+    compact = compact_node({**node, "sub_agents": []})
+    compact["sub_agents"] = [agent_context(sub) for sub in node.get("sub_agents", [])]
+    compact["parent"] = agent_context(parent) if parent else None
+    return json.dumps(strip_empty(compact), separators=(",", ":"))
+
+
+def score_agents(
+    payloads: dict,
+    scoring_api_key: str = None,
+    samples: int = 1,
+    agree: int = None
+) -> dict:
+    """
+    Score single agents concurrently with the scoring agent.
+
+    payloads maps agent ids to agent_scoring_payload output. At most
+    SCORING_FANOUT_MAX_WORKERS calls are in flight. Returns the scoring
+    result of every agent by id.
+    """
+    if not payloads:
+        return {}
+
+    instruction = (
+        "Score this single agent from a larger agent tree. Evaluate all five "
+        "steps for this agent only:"
+    )
+    workers = max(1, min(SCORING_FANOUT_MAX_WORKERS, len(payloads)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                score_agent_tree_sampled,
+                None,
+                scoring_api_key,
+                samples,
+                agree,
+                instruction=instruction,
+                payload=payload
+            ): agent_id
+            for agent_id, payload in payloads.items()
+        }
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
+
+def aggregate_agent_scores(agent_results: dict, names: dict) -> dict:
+    """
+    Combine per-agent category scores into one result for the tree.
+
+    Each category is the mean across agents, rounded to whole points, as the
+    scoring agent aggregates a tree itself. agent_results maps agent ids to
+    {"categories": ..., "debug": ...}. Returns a result shaped like
+    score_agent_tree's.
+    """
+    categories = {}
+    for category in SCORE_CATEGORIES:
+        values = [
+            result["categories"][category]
+            for result in agent_results.values()
+            if isinstance(result["categories"].get(category), (int, float))
+        ]
+        categories[category] = round(sum(values) / len(values)) if values else None
+
+    notes = [
+        f"{names.get(agent_id) or agent_id}: {result['debug']}"
+        for agent_id, result in agent_results.items()
+        if result.get("debug")
+    ]
+    score = total_score(categories)
+    return {
+        "success": True,
+        "score": score,
+        "summary": f"Mean of {len(agent_results)} agent scores",
+        "breakdown": {
+            "score": score,
+            "breakdown": categories,
+            "debug": " ".join(notes),
+        }
+    }
+
+
+def score_tree_per_agent(
+    agent_tree: dict,
+    scoring_api_key: str = None,
+    samples: int = 1,
+    agree: int = None,
+    incremental: bool = False
+) -> dict:
+    """
+    Score each agent with its own concurrent scoring call (fan-out).
+
+    Every request carries one agent plus its parent and sub-agent context
+    (see agent_scoring_payload), so latency tracks the slowest agent rather
+    than one completion covering the whole tree. The tree score is the mean
+    of the agent scores (see aggregate_agent_scores).
+
+    Per-agent results are stored in AGENT_SCORE_STORE for the root agent,
+    under a hash of each agent's payload. With incremental=True, agents
+    whose payload hash is unchanged reuse their stored result and only new
+    and changed agents are scored.
+    """
+    nodes = unique_agent_nodes(agent_tree)
+    if not nodes:
+        return {"success": False, "error": "No fetched agents to score"}
+    root_id = nodes[0][0]["agent"].get("id")
+    names = {node["agent"].get("id"): node["agent"].get("name") for node, _ in nodes}
+    payloads = {node["agent"].get("id"): agent_scoring_payload(node, parent) for node, parent in nodes}
+    hashes = {
+        agent_id: hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        for agent_id, payload in payloads.items()
+    }
+
+    stored = None
+    if incremental and AGENT_SCORE_STORE is not None:
+        stored = AGENT_SCORE_STORE.get(root_id)
+    stored_agents = (stored or {}).get("agents", {})
+    reused = {
+        agent_id: stored_agents[agent_id]["result"]
+        for agent_id, agent_hash in hashes.items()
+        if stored_agents.get(agent_id, {}).get("hash") == agent_hash
+    }
+    changed = {agent_id: payload for agent_id, payload in payloads.items() if agent_id not in reused}
+    print(f"Scoring {len(changed)} of {len(payloads)} agents individually")
+
+    scored = {}
+    failed = {}
+    for agent_id, result in score_agents(changed, scoring_api_key, samples, agree).items():
+        categories = score_categories(result)
+        if categories is None:
+            failed[agent_id] = result.get("error") or "no score breakdown"
+            continue
+        debug = (result.get("breakdown") or {}).get("debug")
+        scored[agent_id] = {"categories": categories, "debug": debug}
+
+    agent_results = {agent_id: reused.get(agent_id) or scored.get(agent_id) for agent_id in payloads}
+    agent_results = {agent_id: result for agent_id, result in agent_results.items() if result}
+    if AGENT_SCORE_STORE is not None:
+        AGENT_SCORE_STORE.set(root_id, {
+            "agents": {
+                agent_id: {"hash": hashes[agent_id], "result": result}
+                for agent_id, result in agent_results.items()
+            }
+        })
+
+    fanout = {
+        "agents": len(payloads),
+        "rescored": len(scored),
+        "reused": len(reused),
+        "failed": sorted(failed),
+    }
+    if failed:
         return {
-            "statusCode": 400,
-            "body": json.dumps({"error": "api_key is required"})
+            "success": False,
+            "error": f"Scoring failed for {len(failed)} of {len(payloads)} agents",
+            "fanout": fanout,
+        }
+
+    result = aggregate_agent_scores(agent_results, names)
+    result["fanout"] = fanout
+    result["agent_scores"] = [
+        {
+            "id": agent_id,
+            "name": names.get(agent_id),
+            "score": total_score(agent_result["categories"]),
+            "breakdown": agent_result["categories"],
+            "reused": agent_id in reused,
         }
+        for agent_id, agent_result in agent_results.items()
+    ]
+    return result
+
+
+def score_tree(
+    agent_tree: dict,
+    scoring_api_key: str = None,
+    scoring_mode: str = None,
+    samples: int = 1,
+    agree: int = None
+) -> dict:
+    """
+    Score the agent tree with the rule engine, the scoring agent, or both.
+
+    With samples > 1 the scoring agent is called that many times concurrently
+    and the results are aggregated (see score_agent_tree_sampled).
+    """
+    scoring_mode = scoring_mode or SCORING_MODE
+    if scoring_mode == "local":
+        return score_agent_tree_locally(agent_tree)
+    if scoring_mode in ("fanout", "incremental"):
+        return score_tree_per_agent(
+            agent_tree,
+            scoring_api_key,
+            samples,
+            agree,
+            incremental=scoring_mode == "incremental"
+        )
+
+    payload, payload_stats = None, None
+    if SCORING_PAYLOAD_COMPACT:
+        payload, payload_stats = build_scoring_payload(agent_tree)
+        if payload_stats["over_budget"]:
+            return {
+                "success": False,
+                "error": (
+                    f"Scoring payload is {payload_stats['compact_chars']} chars after every reduction, "
+                    f"over SCORING_PAYLOAD_MAX_CHARS ({payload_stats['max_chars']})"
+                ),
+                "payload": payload_stats,
+            }
+
+    if scoring_mode == "hybrid":
+        local_result = score_agent_tree_locally(agent_tree)
+        llm_result = score_agent_tree_sampled(
+            agent_tree,
+            scoring_api_key,
+            samples,
+            agree,
+            instruction=(
+                "Score only Step 5 (Prompt Quality) of this agent configuration. "
+                "The other categories are scored separately; report them as 0:"
+            ),
+            payload=payload
+        )
+        result = merge_hybrid_scores(local_result, llm_result)
+        if llm_result.get("samples"):
+            result["samples"] = llm_result["samples"]
+    else:
+        result = score_agent_tree_sampled(agent_tree, scoring_api_key, samples, agree, payload=payload)
+
+    if payload_stats:
+        result["payload"] = payload_stats
+    return result
+
+
+def format_tree_display(tree: dict, indent: str = "") -> str:
+    """Format the tree for human-readable display."""
+    if not tree:
+        return ""
+
+    lines = []
+    agent = tree.get("agent", {})
+
+    # Agent header
+    name = agent.get("name", "Unknown")
+    model = agent.get("model", "N/A")
+    lines.append(f"{indent}[Agent] {name}")
+    lines.append(f"{indent}  Model: {model}")
+    lines.append(f"{indent}  ID: {agent.get('id', 'N/A')}")
+
+    if agent.get("role"):
+        role = agent["role"][:100] + "..." if len(agent.get("role", "")) > 100 else agent.get("role", "")
+        lines.append(f"{indent}  Role: {role}")
+
+    # Tools
+    tools = tree.get("tools", [])
+    if tools:
+        lines.append(f"{indent}  Tools ({len(tools)}):")
+        for tool in tools:
+            tool_name = tool.get("tool_name", "Unknown")
+            source = tool.get("tool_source", "")
+            lines.append(f"{indent}    - {tool_name} ({source})")
+
+    # Sub-agents
+    sub_agents = tree.get("sub_agents", [])
+    if sub_agents:
+        lines.append(f"{indent}  Sub-Agents ({len(sub_agents)}):")
+        for sub in sub_agents:
+            sub_display = format_tree_display(sub, indent + "    ")
+            lines.append(sub_display)
+
+    return "\n".join(lines)
+
+
+def get_param(body: dict, query_params: dict, name: str, default=None):
+    """Read a request parameter from the body, falling back to query parameters."""
+    value = body.get(name)
+    if value is None or value == "":
+        value = query_params.get(name)
+    return default if value is None or value == "" else value
+
+
+def get_flag(body: dict, query_params: dict, name: str) -> bool:
+    """Read a boolean request flag from the body or query parameters."""
+    return bool(body.get(name, False)) or query_params.get(name) == "true"
+
+
+def parse_options(body: dict, query_params: dict) -> tuple:
+    """
+    Parse and validate the scoring options shared by single and batch requests.
+
+    Returns (options, error) where error is a message for a 400 response.
+    """
+    options = {
+        "skip_scoring": get_flag(body, query_params, "skip_scoring"),
+        "scoring_api_key": get_param(body, query_params, "scoring_api_key"),
+        "no_cache": get_flag(body, query_params, "no_cache"),
+        "scoring_mode": get_param(body, query_params, "scoring_mode", SCORING_MODE),
+        "async": get_flag(body, query_params, "async"),
+        "tool_fetch_mode": get_param(body, query_params, "tool_fetch_mode", TOOL_FETCH_MODE),
+        "timings": get_flag(body, query_params, "timings"),
+        "compact": get_flag(body, query_params, "compact"),
+    }
+
+    fields = get_param(body, query_params, "fields")
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    elif fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+        return None, "fields must be a comma-separated string or a list of field names"
+    options["fields"] = fields or None
 
     try:
-        # Fetch all tools first for enrichment
-        print(f"Fetching all tools for API key...")
-        all_tools_list = fetch_all_tools(api_key)
-
-        # Index tools by tool_id for easy lookup
-        all_tools = {}
-        for tool in all_tools_list:
-            if isinstance(tool, dict):
-                tool_id = tool.get("tool_id", "")
-                all_tools[tool_id] = tool
-                # Also index by partial name for matching
-                if "-" in tool_id:
-                    parts = tool_id.split("-")
-                    if len(parts) >= 2:
-                        all_tools["-".join(parts[1:])] = tool
+        options["max_concurrency"] = int(get_param(body, query_params, "max_concurrency", FETCH_MAX_WORKERS))
+    except (TypeError, ValueError):
+        return None, "max_concurrency must be an integer"
 
-        print(f"Indexed {len(all_tools)} tools")
+    try:
+        options["max_agents"] = int(get_param(body, query_params, "max_agents", FETCH_MAX_AGENTS))
+        options["max_depth"] = int(get_param(body, query_params, "max_depth", FETCH_MAX_DEPTH))
+    except (TypeError, ValueError):
+        return None, "max_agents and max_depth must be integers"
+    if options["max_depth"] > FETCH_MAX_DEPTH_LIMIT:
+        return None, f"max_depth must be at most {FETCH_MAX_DEPTH_LIMIT}"
 
-        # Recursively fetch the agent tree
-        print(f"Fetching agent tree starting from {agent_id}...")
-        agent_tree = fetch_agent_tree(agent_id, api_key, all_tools)
+    try:
+        options["samples"] = int(get_param(body, query_params, "samples", 1))
+        agree = get_param(body, query_params, "agree")
+        options["agree"] = int(agree) if agree else None
+    except (TypeError, ValueError):
+        return None, "samples and agree must be integers"
 
-        if not agent_tree:
-            return {
-                "statusCode": 404,
-                "body": json.dumps({"error": f"Agent {agent_id} not found"})
+    if not 1 <= options["samples"] <= SCORING_MAX_SAMPLES:
+        return None, f"samples must be between 1 and {SCORING_MAX_SAMPLES}"
+
+    if options["scoring_mode"] not in SCORING_MODES:
+        return None, f"scoring_mode must be one of {', '.join(SCORING_MODES)}"
+
+    if options["tool_fetch_mode"] not in TOOL_FETCH_MODES:
+        return None, f"tool_fetch_mode must be one of {', '.join(TOOL_FETCH_MODES)}"
+
+    return options, None
+
+
+def load_tools(api_key: str, mode: str = None, deadline: float = None) -> tuple:
+    """
+    Build the tool index for the API key. Returns (all_tools_list, all_tools).
+
+    In "full" mode the whole catalog is downloaded and indexed. In "lazy" mode
+    all_tools_list is None and tools are fetched on demand (LazyToolIndex).
+    Tool fetches are bounded by the deadline, if given.
+    """
+    mode = mode or TOOL_FETCH_MODE
+    if mode == "lazy":
+        return None, LazyToolIndex(api_key, deadline)
+
+    print(f"Fetching all tools for API key...")
+    all_tools_list = fetch_all_tools(api_key, deadline)
+    all_tools = ToolIndex(all_tools_list)
+    print(f"Indexed {len(all_tools)} tools")
+    return all_tools_list, all_tools
+
+
+def fetch_and_analyse(agent_id: str, api_key: str, options: dict, tools: tuple = None) -> Optional[dict]:
+    """
+    Fetch the agent tree and build everything that does not need scoring.
+
+    Returns a dict with agent_tree, statistics, display_tree, tree_hash and
+    the response fields that describe the fetch, or None if the root agent
+    could not be found.
+    """
+    timings = options.get("spans")
+
+    # Fetch all tools first for enrichment
+    if tools is None:
+        with span(timings, "load_tools"):
+            tools = load_tools(api_key, options["tool_fetch_mode"], options.get("deadline"))
+    all_tools_list, all_tools = tools
+
+    # Recursively fetch the agent tree
+    print(f"Fetching agent tree starting from {agent_id}...")
+    cache_before = AGENT_CACHE.stats()
+    with span(timings, "fetch_tree"):
+        agent_tree = fetch_agent_tree(
+            agent_id,
+            api_key,
+            all_tools,
+            max_workers=options["max_concurrency"],
+            use_cache=not options["no_cache"],
+            deadline=options.get("deadline"),
+            max_agents=options["max_agents"],
+            max_depth=options["max_depth"],
+            timings=timings
+        )
+    cache_after = AGENT_CACHE.stats()
+
+    if not agent_tree:
+        return None
+
+    with span(timings, "analyse"):
+        analysis = analyze_tree(agent_tree)
+        tree_hash = canonical_tree_hash(agent_tree)
+    return {
+        "partial": bool(analysis["truncated"]),
+        "truncated": analysis["truncated"],
+        "agent_tree": agent_tree,
+        "statistics": analysis["statistics"],
+        "display_tree": analysis["display_tree"],
+        "tools_available": len(all_tools_list) if all_tools_list is not None else None,
+        "tool_index": all_tools.stats(),
+        "tree_hash": tree_hash,
+        "cache": {
+            "agent_cache": {
+                "hits": cache_after["hits"] - cache_before["hits"],
+                "misses": cache_after["misses"] - cache_before["misses"],
+                "size": cache_after["size"],
+                "bypassed": bool(options["no_cache"]),
             }
+        },
+    }
+
+
+def run_scoring(agent_tree: dict, tree_hash: str, options: dict) -> dict:
+    """
+    Score the tree, reusing the stored score for an identical tree.
+
+    Returns the score-first response fields (score, breakdown, debug, ...).
+    """
+    scoring_mode = options["scoring_mode"]
+    score_cache_key = f"{scoring_mode}:{tree_hash}"
+    if options["samples"] > 1:
+        # A single-sample score must not answer a multi-sample request
+        score_cache_key = f"{scoring_mode}:samples={options['samples']}:agree={options['agree']}:{tree_hash}"
+    scoring_result = None
+    score_cache_hit = False
+    if SCORE_CACHE is not None and not options["no_cache"]:
+        scoring_result = SCORE_CACHE.get(score_cache_key)
+        score_cache_hit = scoring_result is not None
+
+    if score_cache_hit:
+        print(f"Score cache hit for tree {tree_hash[:12]}")
+    else:
+        print(f"Scoring agent tree ({scoring_mode})...")
+        with span(options.get("spans"), "scoring"):
+            scoring_result = score_tree(
+                agent_tree,
+                options["scoring_api_key"],
+                scoring_mode,
+                options["samples"],
+                options["agree"]
+            )
+        print(f"Scoring complete: {scoring_result.get('summary', 'N/A')}")
+        if SCORE_CACHE is not None and scoring_result.get("success") and scoring_result.get("breakdown"):
+            SCORE_CACHE.set(score_cache_key, scoring_result)
+
+    breakdown = scoring_result.get("breakdown", {})
+    inner_breakdown = breakdown.get("breakdown", {})
+
+    score_fields = {}
+    score_fields["score"] = inner_breakdown.get("score") or breakdown.get("score")
+    score_fields["breakdown"] = {
+        "architecture": inner_breakdown.get("architecture"),
+        "tools": inner_breakdown.get("tools"),
+        "knowledge": inner_breakdown.get("knowledge"),
+        "quality": inner_breakdown.get("quality"),
+        "prompts": inner_breakdown.get("prompts")
+    }
+    debug = inner_breakdown.get("debug") or breakdown.get("debug")
+    if debug:
+        score_fields["debug"] = debug
+    score_fields["scoring_mode"] = scoring_mode
+    score_fields["cache_hit"] = score_cache_hit
+    if scoring_result.get("samples"):
+        score_fields["samples"] = scoring_result["samples"]
+    if scoring_result.get("payload"):
+        score_fields["scoring_payload"] = scoring_result["payload"]
+    if scoring_result.get("fanout"):
+        score_fields["fanout"] = scoring_result["fanout"]
+    if scoring_result.get("agent_scores"):
+        score_fields["agent_scores"] = scoring_result["agent_scores"]
+    if not scoring_result.get("success"):
+        score_fields["scoring_error"] = scoring_result.get("error")
+    elif score_fields["score"] is not None:
+        record_score(agent_tree, tree_hash, score_fields, options)
+    return score_fields
+
+
+def record_score(agent_tree: dict, tree_hash: str, score_fields: dict, options: dict):
+    """Add a score to SCORE_HISTORY. Failures are logged, never raised."""
+    if SCORE_HISTORY is None:
+        return
+    agent = agent_tree.get("agent") or {}
+    timings = options.get("spans")
+    if timings is not None:
+        timing = timings.to_dict()
+        timings = {"total_ms": timing["total_ms"], "phases": timing["phases"]}
+    try:
+        SCORE_HISTORY.record({
+            "root_agent_id": agent.get("id") or agent_tree.get("id"),
+            "agent_name": agent.get("name"),
+            "tree_hash": tree_hash,
+            "score": score_fields["score"],
+            "breakdown": score_fields["breakdown"],
+            "scoring_mode": score_fields["scoring_mode"],
+            "cache_hit": score_fields["cache_hit"],
+            "timings": timings,
+        })
+    except Exception as e:
+        print(f"Could not record score history: {str(e)}")
+
+
+def query_score_history(
+    query: str,
+    agent_id: Optional[str],
+    limit,
+    scoring_mode: str,
+    api_key: Optional[str]
+) -> tuple:
+    """
+    Answer a leaderboard query from SCORE_HISTORY without calling upstream.
+
+    query is "top" (each agent's best score), "latest" (each agent's latest
+    score) or "history" (one agent's scores, newest first), all limited to
+    scores from scoring_mode. api_key must match SCORE_HISTORY_API_KEY
+    unless SCORE_HISTORY_PUBLIC is set. Returns (status_code, response_data).
+    """
+    if SCORE_HISTORY is None:
+        return 400, {"error": "Score history is disabled"}
+    if not SCORE_HISTORY_PUBLIC:
+        if not SCORE_HISTORY_API_KEY:
+            return 403, {"error": "Score history queries are disabled (set SCORE_HISTORY_API_KEY)"}
+        import hmac
+
+        if not api_key or not hmac.compare_digest(api_key.encode(), SCORE_HISTORY_API_KEY.encode()):
+            return 401, {"error": "Score history queries need a valid api_key"}
+    if query not in SCORE_HISTORY_QUERIES:
+        return 400, {"error": f"query must be one of {', '.join(SCORE_HISTORY_QUERIES)}"}
+    try:
+        limit = int(limit if limit is not None else 10)
+    except (TypeError, ValueError):
+        return 400, {"error": "limit must be an integer"}
+    if not 1 <= limit <= SCORE_HISTORY_MAX_LIMIT:
+        return 400, {"error": f"limit must be between 1 and {SCORE_HISTORY_MAX_LIMIT}"}
+
+    if query == "history":
+        if not agent_id:
+            return 400, {"error": "agent_id is required for query=history"}
+        results = SCORE_HISTORY.history(agent_id, scoring_mode, limit)
+        return 200, {
+            "query": query, "agent_id": agent_id, "scoring_mode": scoring_mode, "limit": limit, "results": results
+        }
+    if query == "top":
+        results = SCORE_HISTORY.top(scoring_mode, limit)
+    else:
+        results = SCORE_HISTORY.latest(scoring_mode, limit)
+    return 200, {"query": query, "scoring_mode": scoring_mode, "limit": limit, "results": results}
+
+
+def deadline_passed(options: dict) -> bool:
+    """Return True if the request's fetch deadline (if any) has passed."""
+    deadline = options.get("deadline")
+    return deadline is not None and time.monotonic() >= deadline
 
-        # Build statistics
-        statistics = build_statistics(agent_tree)
 
-        # Format display tree
-        display_tree = format_tree_display(agent_tree)
+def deadline_response(stage: str) -> dict:
+    """Response data for work skipped because the deadline passed."""
+    return {"error": f"Lambda deadline reached before {stage}", "reason": "deadline"}
 
-        # Score the agent tree
-        scoring_result = None
-        if not skip_scoring:
-            print("Scoring agent tree...")
-            scoring_result = score_agent_tree(agent_tree, scoring_api_key)
-            print(f"Scoring complete: {scoring_result.get('summary', 'N/A')}")
+
+def process_agent(
+    agent_id: str,
+    api_key: str,
+    options: dict,
+    tools: tuple = None,
+    stop_at_deadline: bool = False
+) -> tuple:
+    """
+    Fetch, analyse and score one root agent.
+
+    tools is an optional (all_tools_list, all_tools) pair from load_tools,
+    shared when several agents use the same API key. Scoring is not started
+    once the deadline has passed: the tree is returned unscored, with
+    scoring_error set, or with stop_at_deadline a 504 is returned instead.
+
+    Returns (status_code, response_data).
+    """
+    try:
+        analysis = fetch_and_analyse(agent_id, api_key, options, tools)
+        if not analysis:
+            return 404, {"error": f"Agent {agent_id} not found"}
 
         # Build response with score first
         response_data = {}
-
-        # Add scoring at the top if available
-        if scoring_result:
-            breakdown = scoring_result.get("breakdown", {})
-            inner_breakdown = breakdown.get("breakdown", {})
-
-            response_data["score"] = inner_breakdown.get("score") or breakdown.get("score")
-            response_data["breakdown"] = {
-                "architecture": inner_breakdown.get("architecture"),
-                "tools": inner_breakdown.get("tools"),
-                "knowledge": inner_breakdown.get("knowledge"),
-                "quality": inner_breakdown.get("quality"),
-                "prompts": inner_breakdown.get("prompts")
-            }
-            if inner_breakdown.get("debug"):
-                response_data["debug"] = inner_breakdown.get("debug")
+        if not options["skip_scoring"] and deadline_passed(options):
+            if stop_at_deadline:
+                return 504, deadline_response("scoring")
+            response_data["score"] = None
+            response_data["scoring_error"] = deadline_response("scoring")["error"]
+        elif not options["skip_scoring"]:
+            response_data.update(run_scoring(analysis["agent_tree"], analysis["tree_hash"], options))
 
         # Add the rest of the data
-        response_data["statistics"] = statistics
-        response_data["agent_tree"] = agent_tree
-        response_data["display_tree"] = display_tree
-        response_data["tools_available"] = len(all_tools_list)
+        response_data["statistics"] = analysis["statistics"]
+        response_data["agent_tree"] = analysis["agent_tree"]
+        response_data["display_tree"] = analysis["display_tree"]
+        response_data["tools_available"] = analysis["tools_available"]
+        response_data["tool_index"] = analysis["tool_index"]
+        response_data["tree_hash"] = analysis["tree_hash"]
+        response_data["cache"] = analysis["cache"]
+        if analysis["partial"]:
+            response_data["partial"] = True
+            response_data["truncated"] = analysis["truncated"]
+
+        return 200, response_data
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps(response_data, indent=2)
+    except Exception as e:
+        print(f"Error processing agent {agent_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return 500, {"error": str(e)}
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time; concurrent callers with the same key
+    wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn) -> tuple:
+        """Return (result, shared), where shared is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+
+        if not leader:
+            call["done"].wait()
+        else:
+            try:
+                call["result"] = fn()
+            except BaseException as e:
+                call["error"] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call["done"].set()
+
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"], not leader
+
+
+# Options that change the response of process_agent; two requests are
+# coalesced only if these match
+COALESCED_OPTIONS = (
+    "skip_scoring", "scoring_api_key", "no_cache", "scoring_mode", "tool_fetch_mode",
+    "max_agents", "max_depth", "samples", "agree",
+)
+
+IN_FLIGHT = SingleFlight()
+
+
+def process_agent_coalesced(
+    agent_id: str,
+    api_key: str,
+    options: dict,
+    tools: tuple = None,
+    stop_at_deadline: bool = False
+) -> tuple:
+    """
+    process_agent, shared with identical requests already in flight.
+
+    Responses served from another request's work carry "coalesced": true and
+    no phase timings of their own. Returns (status_code, response_data).
+    """
+    if not COALESCE_REQUESTS:
+        return process_agent(agent_id, api_key, options, tools, stop_at_deadline)
+
+    key = hashlib.sha256(json.dumps(
+        [agent_id, api_key, [options.get(name) for name in COALESCED_OPTIONS]]
+    ).encode("utf-8")).hexdigest()
+    (status_code, data), shared = IN_FLIGHT.do(
+        key, lambda: process_agent(agent_id, api_key, options, tools, stop_at_deadline)
+    )
+
+    # Every caller adds its own upstream counts and timings, so each gets a copy
+    data = dict(data)
+    if shared:
+        data["coalesced"] = True
+    return status_code, data
+
+
+class TokenBucket:
+    """Admits rate requests per second on average, with bursts of up to burst."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 if admitted, else seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+ADMISSION_BUCKETS = OrderedDict()
+ADMISSION_LOCK = threading.Lock()
+
+
+def admit(api_key: str) -> int:
+    """
+    Apply the per-API-key admission limit.
+
+    Returns 0 if the request may proceed, else the Retry-After in whole
+    seconds. Buckets for the least recently seen keys are dropped beyond
+    ADMISSION_MAX_KEYS.
+    """
+    if ADMISSION_RATE_PER_KEY <= 0:
+        return 0
+
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with ADMISSION_LOCK:
+        bucket = ADMISSION_BUCKETS.get(key)
+        if bucket is None:
+            bucket = ADMISSION_BUCKETS[key] = TokenBucket(ADMISSION_RATE_PER_KEY, ADMISSION_BURST_PER_KEY)
+            if len(ADMISSION_BUCKETS) > ADMISSION_MAX_KEYS:
+                ADMISSION_BUCKETS.popitem(last=False)
+        else:
+            ADMISSION_BUCKETS.move_to_end(key)
+
+    wait = bucket.take()
+    return max(1, int(wait + 0.999)) if wait else 0
+
+
+def rate_limited_response(retry_after: int) -> dict:
+    """Response data for a request rejected by admit()."""
+    return {"error": "Rate limit exceeded for this API key", "retry_after": retry_after}
+
+
+def save_job(job: dict):
+    """Write a job record to the job store."""
+    job["updated_at"] = time.time()
+    JOB_STORE.set(job["job_id"], job)
+
+
+def run_scoring_job(job: dict, agent_tree: dict, tree_hash: str, options: dict):
+    """Score the tree in the background and store the outcome on the job."""
+    try:
+        job["result"] = run_scoring(agent_tree, tree_hash, options)
+        job["status"] = "complete"
+    except Exception as e:
+        print(f"Scoring job {job['job_id']} failed: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+    save_job(job)
+
+
+# Options an async scoring invocation needs to score a job like the request did
+SCORING_JOB_OPTIONS = ("scoring_mode", "scoring_api_key", "samples", "agree", "no_cache")
+
+LAMBDA_CLIENT = None
+
+
+def dispatch_scoring_job(job_id: str, options: dict, function_name: str):
+    """
+    Invoke this function asynchronously (InvocationType "Event") to score a
+    pending job. The invocation reads the tree from the job record.
+    """
+    global LAMBDA_CLIENT
+    if LAMBDA_CLIENT is None:
+        import boto3
+        LAMBDA_CLIENT = boto3.client("lambda")
+
+    payload = {
+        "scoring_job_id": job_id,
+        "scoring_options": {name: options[name] for name in SCORING_JOB_OPTIONS},
+    }
+    LAMBDA_CLIENT.invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps(payload).encode("utf-8")
+    )
+
+
+def run_dispatched_job(event: dict) -> dict:
+    """Score a job handed over by dispatch_scoring_job."""
+    job_id = event["scoring_job_id"]
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        print(f"Scoring job {job_id} not found in the job store")
+        return {"statusCode": 404, "body": json.dumps({"error": f"Job {job_id} not found"})}
+    if job["status"] != "pending":
+        return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": job["status"]})}
+
+    options = dict(event.get("scoring_options") or {}, spans=Timings())
+    agent_tree = job.pop("agent_tree")
+    run_scoring_job(job, agent_tree, job["tree_hash"], options)
+    return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": job["status"]})}
+
+
+def start_agent_job(agent_id: str, api_key: str, options: dict, function_name: str = None) -> tuple:
+    """
+    Fetch the tree now and score it in the background.
+
+    With ASYNC_DISPATCH "lambda" the tree is stored on the job record and
+    scored by an asynchronous invocation of function_name; with "thread" it
+    is scored in a background thread of this process.
+
+    Returns (status_code, response_data) with statistics, display_tree and
+    the job_id to poll for the score.
+    """
+    import uuid
+
+    if ASYNC_DISPATCH == "lambda" and JOB_STORE_BACKEND != "sqlite":
+        return 500, {"error": "Async scoring on Lambda needs a shared job store (JOB_STORE_BACKEND=sqlite)"}
+    if ASYNC_DISPATCH == "lambda" and os.path.abspath(JOB_STORE_PATH).startswith("/tmp/"):
+        # /tmp is per container: the scoring invocation and the poll would
+        # each see their own job store
+        return 500, {"error": "Async scoring on Lambda needs JOB_STORE_PATH on shared storage such as EFS, not /tmp"}
+    function_name = function_name or ASYNC_FUNCTION_NAME
+    if ASYNC_DISPATCH == "lambda" and not function_name:
+        return 500, {"error": "Async scoring needs ASYNC_FUNCTION_NAME"}
+
+    try:
+        analysis = fetch_and_analyse(agent_id, api_key, options)
+        if not analysis:
+            return 404, {"error": f"Agent {agent_id} not found"}
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": "pending",
+            "agent_id": agent_id,
+            "tree_hash": analysis["tree_hash"],
+            "created_at": time.time(),
+        }
+        if ASYNC_DISPATCH == "lambda":
+            save_job(dict(job, agent_tree=analysis["agent_tree"]))
+            try:
+                dispatch_scoring_job(job["job_id"], options, function_name)
+            except Exception as e:
+                print(f"Could not dispatch scoring job {job['job_id']}: {str(e)}")
+                save_job(dict(job, status="failed", error=f"dispatch failed: {str(e)}"))
+                return 500, {"error": f"Could not start the scoring job: {str(e)}"}
+        else:
+            save_job(job)
+            threading.Thread(
+                target=run_scoring_job,
+                args=(dict(job), analysis["agent_tree"], analysis["tree_hash"], options),
+                daemon=True
+            ).start()
+
+        return 202, {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "statistics": analysis["statistics"],
+            "display_tree": analysis["display_tree"],
+            "tools_available": analysis["tools_available"],
+            "tree_hash": analysis["tree_hash"],
+            "cache": analysis["cache"],
+            "partial": analysis["partial"],
+            "truncated": analysis["truncated"],
         }
 
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        print(f"Error processing agent {agent_id}: {str(e)}")
         import traceback
         traceback.print_exc()
+        return 500, {"error": str(e)}
+
+
+def get_job(job_id: str) -> tuple:
+    """Look up a scoring job. Returns (status_code, response_data)."""
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return 404, {"error": f"Job {job_id} not found"}
+
+    response_data = {"job_id": job_id, "status": job["status"], "agent_id": job.get("agent_id")}
+    if job["status"] == "complete":
+        response_data.update(job["result"])
+    elif job["status"] == "failed":
+        response_data["error"] = job.get("error")
+    return 200, response_data
+
+
+def process_batch(entries: list, options: dict, max_workers: int = None) -> dict:
+    """
+    Score many root agents in one invocation with bounded parallelism.
+
+    The tool catalog is fetched once per API key and shared by every entry
+    that uses it. A failing entry is reported under "failures" and does not
+    abort the rest of the batch. Entries are not started, and not scored,
+    once the deadline has passed; they fail with 504 and reason "deadline".
+    """
+    if max_workers is None:
+        max_workers = BATCH_MAX_WORKERS
+
+    tool_indexes = {}
+    tool_locks = {}
+    locks_guard = threading.Lock()
+
+    def tools_for(api_key: str) -> tuple:
+        with locks_guard:
+            lock = tool_locks.setdefault(api_key, threading.Lock())
+        with lock:
+            if api_key not in tool_indexes:
+                with span(options.get("spans"), "load_tools"):
+                    tool_indexes[api_key] = load_tools(api_key, options["tool_fetch_mode"], options.get("deadline"))
+            return tool_indexes[api_key]
+
+    def run(index: int, entry) -> dict:
+        if not isinstance(entry, dict):
+            return {"index": index, "status_code": 400, "error": "entry must be an object"}
+        agent_id = entry.get("agent_id")
+        api_key = entry.get("api_key")
+        if not agent_id:
+            return {"index": index, "status_code": 400, "error": "agent_id is required"}
+        if not api_key:
+            return {"index": index, "agent_id": agent_id, "status_code": 400, "error": "api_key is required"}
+
+        if deadline_passed(options):
+            return {"index": index, "agent_id": agent_id, "status_code": 504, **deadline_response("this entry started")}
+
+        retry_after = admit(api_key)
+        if retry_after:
+            return {"index": index, "agent_id": agent_id, "status_code": 429, **rate_limited_response(retry_after)}
+
+        try:
+            status_code, data = process_agent_coalesced(
+                agent_id, api_key, options, tools_for(api_key), stop_at_deadline=True
+            )
+        except Exception as e:
+            status_code, data = 500, {"error": str(e)}
+        return {"index": index, "agent_id": agent_id, "status_code": status_code, **data}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        outcomes = list(executor.map(run, range(len(entries)), entries))
+
+    results = [outcome for outcome in outcomes if outcome["status_code"] == 200]
+    failures = [outcome for outcome in outcomes if outcome["status_code"] != 200]
+    return {
+        "total": len(entries),
+        "succeeded": len(results),
+        "failed": len(failures),
+        "results": results,
+        "failures": failures,
+    }
+
+
+# Fields kept in every projected response or batch entry
+ALWAYS_RETURNED_FIELDS = ("error", "index", "agent_id", "status_code")
+
+
+def project_fields(data: dict, fields: Optional[list]) -> dict:
+    """
+    Keep only the requested top-level fields of a response.
+
+    Batch responses keep their totals and project each entry in results
+    and failures instead.
+    """
+    if not fields:
+        return data
+
+    keep = set(fields).union(ALWAYS_RETURNED_FIELDS)
+    if "results" in data and "failures" in data:
+        projected = dict(data)
+        for key in ("results", "failures"):
+            projected[key] = [
+                {name: value for name, value in entry.items() if name in keep}
+                for entry in data[key]
+            ]
+        return projected
+    return {name: value for name, value in data.items() if name in keep}
+
+
+def accepts_gzip(event: dict) -> bool:
+    """Return True if the request's Accept-Encoding header allows gzip."""
+    headers = event.get("headers") or {}
+    for name, value in headers.items():
+        if name.lower() == "accept-encoding" and value:
+            return "gzip" in value.lower()
+    return False
+
+
+def build_response(status_code: int, data: dict, event: dict, options: dict, headers: dict = None) -> dict:
+    """
+    Serialize a response for API Gateway.
+
+    Applies the fields projection, pretty-prints successful responses unless
+    compact is set, and gzips large bodies (base64-encoded) for clients that
+    accept it. headers are added to the response as given.
+    """
+    data = project_fields(data, options.get("fields"))
+    if options.get("compact") or status_code >= 400:
+        body = json.dumps(data, separators=(",", ":"))
+    else:
+        body = json.dumps(data, indent=2)
+
+    if len(body) < RESPONSE_GZIP_MIN_BYTES or not accepts_gzip(event):
+        response = {"statusCode": status_code, "body": body}
+        if headers:
+            response["headers"] = dict(headers)
+        return response
+
+    import base64
+    import gzip
+
+    compressed = gzip.compress(body.encode("utf-8"), compresslevel=RESPONSE_GZIP_LEVEL)
+    return {
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Vary": "Accept-Encoding",
+            **(headers or {}),
+        },
+        "isBase64Encoded": True,
+        "body": base64.b64encode(compressed).decode("ascii"),
+    }
+
+
+def log_metrics(status_code: int, timings: Timings, upstream: dict, **fields):
+    """Print one structured JSON metrics line for the invocation."""
+    timing = timings.to_dict()
+    agent_fetch_ms = timing["agent_fetch_ms"].values()
+    print(json.dumps({
+        "metric": "scoring_request",
+        "status_code": status_code,
+        **fields,
+        "total_ms": timing["total_ms"],
+        "phases": timing["phases"],
+        "agents_fetched": len(agent_fetch_ms),
+        "slowest_agent_fetch_ms": max(agent_fetch_ms, default=None),
+        "upstream": upstream,
+    }))
+
+
+def lambda_handler(event, context):
+    """
+    Lambda handler to recursively fetch agent configurations and score them.
+
+    Expected input (via event body or query parameters):
+    - agent_id: The root agent ID to start from
+    - api_key: The Lyzr API key for authentication
+    - skip_scoring: (optional) Set to true to skip scoring
+    - scoring_api_key: (optional) Override the scoring agent API key
+    - max_concurrency: (optional) Max agent fetches in flight (1 = sequential)
+    - no_cache: (optional) Set to true to bypass cached agent configs
+    - scoring_mode: (optional) "llm" (default), "local", "hybrid", "fanout" or "incremental"
+    - samples: (optional) Number of concurrent scoring calls to aggregate
+    - agree: (optional) Stop early once this many samples agree
+    - batch: (optional) List of {agent_id, api_key} entries to score in one call,
+      instead of agent_id/api_key
+    - batch_concurrency: (optional) Max batch entries processed at once
+    - tool_fetch_mode: (optional) "full" (default) or "lazy"
+    - max_agents: (optional) Max unique agents to fetch
+    - max_depth: (optional) Max levels of sub-agents below the root
+    - async: (optional) Set to true to return the tree immediately with a job_id
+      and score in the background
+    - job_id: (optional) Look up the result of an async scoring job
+    - query: (optional) "top", "latest" or "history" to read the score history
+      of one scoring_mode instead of scoring (with limit, agent_id for
+      "history", and api_key set to SCORE_HISTORY_API_KEY)
+    - timings: (optional) Set to true to include per-phase timings
+    - fields: (optional) Comma-separated top-level fields to return
+    - compact: (optional) Set to true for unindented JSON
+
+    Responses are gzipped (base64-encoded) when the request sends
+    Accept-Encoding: gzip. With ADMISSION_RATE_PER_KEY set, requests over an
+    API key's limit get a 429 with a Retry-After header.
+
+    Returns:
+    - agent_tree: Complete tree of agents and sub-agents with their configs
+    - statistics: Summary statistics about the agent hierarchy
+    - display_tree: Human-readable tree representation
+    - scoring: Score and breakdown from the scoring agent
+    - upstream: Retry, hedge and circuit breaker counts for this invocation
+    - timings: (when requested) Phase and per-agent fetch durations in ms
+    For batch requests: per-entry results and failures.
+    For async requests: statistics, display_tree and job_id (202); job_id
+    lookups return the job status and, once complete, the score fields.
+    For queries: the matching score history records.
+    Direct invocations with scoring_job_id (from dispatch_scoring_job) score
+    a pending async job.
+    """
+    # Asynchronous scoring invocation from dispatch_scoring_job
+    if "scoring_job_id" in event and "body" not in event and "requestContext" not in event:
+        return run_dispatched_job(event)
+
+    # Parse input
+    if isinstance(event.get("body"), str):
+        body = json.loads(event.get("body", "{}"))
+    else:
+        body = event.get("body") or event
+
+    # Support both body and query parameters
+    query_params = event.get("queryStringParameters") or {}
+
+    options, error = parse_options(body, query_params)
+    if error:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": error})
+        }
+
+    upstream_before = UPSTREAM_STATS.snapshot()
+    timings = options["spans"] = Timings()
+
+    # Stop fetching early enough to leave time for scoring and the response
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        remaining_ms = context.get_remaining_time_in_millis() - FETCH_DEADLINE_RESERVE_MS
+        options["deadline"] = time.monotonic() + remaining_ms / 1000
+
+    # Async job lookup
+    job_id = get_param(body, query_params, "job_id")
+    if job_id:
+        status_code, response_data = get_job(job_id)
+        return build_response(status_code, response_data, event, options)
+
+    # Leaderboard queries are answered from the score history alone
+    query = get_param(body, query_params, "query")
+    if query:
+        status_code, response_data = query_score_history(
+            query,
+            get_param(body, query_params, "agent_id"),
+            get_param(body, query_params, "limit"),
+            options["scoring_mode"],
+            get_param(body, query_params, "api_key")
+        )
+        return build_response(status_code, response_data, event, options)
+
+    # Batch of root agents
+    if "batch" in body:
+        entries = body["batch"]
+        if not isinstance(entries, list) or not entries:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "batch must be a non-empty list"})
+            }
+        if len(entries) > BATCH_MAX_ENTRIES:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": f"batch is limited to {BATCH_MAX_ENTRIES} entries"})
+            }
+        try:
+            batch_concurrency = int(body.get("batch_concurrency") or BATCH_MAX_WORKERS)
+        except (TypeError, ValueError):
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "batch_concurrency must be an integer"})
+            }
+
+        print(f"Processing batch of {len(entries)} agents...")
+        batch_result = process_batch(entries, options, batch_concurrency)
+        batch_result["upstream"] = upstream_delta(upstream_before)
+        if options["timings"]:
+            batch_result["timings"] = timings.to_dict()
+        log_metrics(200, timings, batch_result["upstream"], batch_size=len(entries))
+        return build_response(200, batch_result, event, options)
+
+    agent_id = get_param(body, query_params, "agent_id")
+    api_key = get_param(body, query_params, "api_key")
+
+    # Validation
+    if not agent_id:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "agent_id is required"})
+        }
+
+    if not api_key:
         return {
-            "statusCode": 500,
-            "body": json.dumps({"error": str(e)})
+            "statusCode": 400,
+            "body": json.dumps({"error": "api_key is required"})
         }
 
+    retry_after = admit(api_key)
+    if retry_after:
+        log_metrics(429, timings, upstream_delta(upstream_before), agent_id=agent_id)
+        return build_response(
+            429, rate_limited_response(retry_after), event, options, {"Retry-After": str(retry_after)}
+        )
+
+    if options["async"] and not options["skip_scoring"]:
+        status_code, response_data = start_agent_job(
+            agent_id, api_key, options, getattr(context, "invoked_function_arn", None)
+        )
+    else:
+        status_code, response_data = process_agent_coalesced(agent_id, api_key, options)
+    response_data["upstream"] = upstream_delta(upstream_before)
+    if options["timings"]:
+        response_data["timings"] = timings.to_dict()
+    log_metrics(
+        status_code, timings, response_data["upstream"],
+        agent_id=agent_id, coalesced=response_data.get("coalesced", False)
+    )
+    return build_response(status_code, response_data, event, options)
+
+
+def prewarm():
+    """Open pooled connections to BASE_URL during the Lambda init phase."""
+    started = time.monotonic()
+    try:
+        opened = HTTP_POOL.prewarm(BASE_URL, INIT_PREWARM_CONNECTIONS, INIT_PREWARM_TIMEOUT)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Init prewarm failed for {BASE_URL}: {e}")
+        return
+    print(f"Init prewarm: {opened} connection(s) to {BASE_URL} in {(time.monotonic() - started) * 1000:.0f} ms")
+
+
+if INIT_PREWARM:
+    prewarm()
+
 
 # For local testing
 if __name__ == "__main__":
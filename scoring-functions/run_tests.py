@@ -4,15 +4,25 @@ Test runner for fetchAgentsRecursively Lambda function.
 Runs all test events against the deployed API endpoint.
 """
 
+import gzip
 import json
+import threading
+import time
 import urllib.request
 import urllib.error
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Deployed API endpoint
 API_ENDPOINT = "https://jitzti21x0.execute-api.us-east-1.amazonaws.com/default/fetchAgentsRecursively"
 
+# Event key holding the runner's checks for that event; it is not sent
+TEST_KEY = "_test"
+
+# Seconds between job_id lookups while polling an async job
+POLL_INTERVAL = 0.5
+
 
 def load_test_events(events_dir: str = "events") -> list:
     """Load all test event JSON files from the events directory."""
@@ -38,36 +48,116 @@ def load_test_events(events_dir: str = "events") -> list:
     return test_events
 
 
-def call_api(event: dict, timeout: int = 180) -> dict:
+def split_event(event: dict) -> tuple:
+    """Split an event file into (request body, runner checks)."""
+    body = {key: value for key, value in event.items() if key != TEST_KEY}
+    return body, event.get(TEST_KEY) or {}
+
+
+def call_api(event: dict, timeout: int = 180, headers: dict = None) -> dict:
     """Call the deployed API endpoint with the given event."""
     req = urllib.request.Request(
         API_ENDPOINT,
         data=json.dumps(event).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
+        headers={"Content-Type": "application/json", **(headers or {})},
         method="POST"
     )
 
+    start = time.perf_counter()
     try:
         with urllib.request.urlopen(req, timeout=timeout) as response:
             status_code = response.status
-            body = json.loads(response.read().decode("utf-8"))
-            return {"status_code": status_code, "body": body, "error": None}
+            encoding = response.headers.get("Content-Encoding")
+            data = response.read()
+            if encoding == "gzip":
+                data = gzip.decompress(data)
+            body = json.loads(data.decode("utf-8"))
+            response = {"status_code": status_code, "body": body, "error": None, "encoding": encoding}
     except urllib.error.HTTPError as e:
         try:
             error_body = json.loads(e.read().decode("utf-8"))
         except:
             error_body = {"error": e.reason}
-        return {"status_code": e.code, "body": error_body, "error": e.reason}
+        response = {"status_code": e.code, "body": error_body, "error": e.reason}
     except urllib.error.URLError as e:
-        return {"status_code": None, "body": None, "error": str(e.reason)}
+        response = {"status_code": None, "body": None, "error": str(e.reason)}
     except Exception as e:
-        return {"status_code": None, "body": None, "error": str(e)}
+        response = {"status_code": None, "body": None, "error": str(e)}
+
+    response["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return response
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: list) -> dict:
+    """p50/p95/p99/max latency in milliseconds for a list of latencies."""
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def poll_job(job_id: str, timeout: int = 180) -> dict:
+    """Look up an async job until it is no longer pending or timeout passes."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        response = call_api({"job_id": job_id}, timeout)
+        body = response["body"] or {}
+        if body.get("status") != "pending" or time.perf_counter() >= deadline:
+            return response
+        time.sleep(POLL_INTERVAL)
+
+
+def check_response(event: dict, checks: dict, response: dict) -> list:
+    """
+    Apply an event's runner checks to a successful response.
+
+    checks may list top-level keys the body must contain ("expect") or must
+    not contain ("absent"), the expected Content-Encoding ("encoding"), and
+    whether the body must carry a score ("scored", ignored with
+    skip_scoring). Polled jobs must have completed, and batch responses
+    must have no failures. Returns a list of problems, empty if all pass.
+    """
+    body = response["body"]
+    problems = []
+    if checks.get("poll") and body.get("job_id") and body.get("status") != "complete":
+        problems.append(f"job {body.get('status')}")
+    missing = [key for key in checks.get("expect", []) if key not in body]
+    if missing:
+        problems.append(f"missing {', '.join(missing)}")
+    present = [key for key in checks.get("absent", []) if key in body]
+    if present:
+        problems.append(f"unexpected {', '.join(present)}")
+    if checks.get("encoding") and response.get("encoding") != checks["encoding"]:
+        problems.append(f"Content-Encoding {response.get('encoding')}, expected {checks['encoding']}")
+    if checks.get("scored") and not event.get("skip_scoring"):
+        if body.get("score") is None or body.get("scoring_error"):
+            problems.append(f"not scored: {body.get('scoring_error', 'no score')}")
+    if body.get("failures"):
+        problems.append(f"{len(body['failures'])} batch failure(s): {body['failures'][0].get('error')}")
+    return problems
 
 
 def run_test(test_case: dict, verbose: bool = False, timeout: int = 180) -> dict:
-    """Run a single test case and return results."""
+    """
+    Run a single test case and return results.
+
+    With "poll" in the event's checks, a job_id in the response is polled
+    until the job finishes, and the checks apply to the finished job.
+    """
     name = test_case["name"]
-    event = test_case["event"]
+    event, checks = split_event(test_case["event"])
 
     result = {
         "name": name,
@@ -77,8 +167,11 @@ def run_test(test_case: dict, verbose: bool = False, timeout: int = 180) -> dict
         "summary": None
     }
 
-    response = call_api(event, timeout)
+    response = call_api(event, timeout, checks.get("headers"))
     result["status_code"] = response["status_code"]
+    result["latency_ms"] = response["latency_ms"]
+    if checks.get("poll") and response["body"] and response["body"].get("job_id"):
+        response = poll_job(response["body"]["job_id"], timeout)
 
     if response["error"] and not response["body"]:
         result["error"] = response["error"]
@@ -97,7 +190,8 @@ def run_test(test_case: dict, verbose: bool = False, timeout: int = 180) -> dict
         else:
             result["summary"] = f"Unexpected error: {body['error']}"
     else:
-        result["passed"] = True
+        problems = check_response(event, checks, response)
+        result["passed"] = not problems
 
         # Build summary
         stats = body.get("statistics", {})
@@ -115,6 +209,16 @@ def run_test(test_case: dict, verbose: bool = False, timeout: int = 180) -> dict
         elif scoring and not scoring.get("success"):
             summary_parts.append(f"Scoring failed: {scoring.get('error', 'unknown')}")
 
+        if "total" in body:
+            summary_parts.append(f"Batch: {body.get('succeeded', 0)}/{body['total']} succeeded")
+        if "query" in body:
+            summary_parts.append(f"Query {body['query']}: {len(body.get('results', []))} result(s)")
+        if body.get("job_id"):
+            summary_parts.append(f"Job: {body.get('status')}")
+        if body.get("score") is not None:
+            summary_parts.append(f"Score: {body['score']}/100")
+        summary_parts.extend(problems)
+
         result["summary"] = " | ".join(summary_parts) if summary_parts else "OK"
 
         if verbose:
@@ -127,21 +231,242 @@ def print_result(result: dict, show_details: bool = False):
     """Print a single test result."""
     status = "✅ PASS" if result["passed"] else "❌ FAIL"
     print(f"{status} | {result['name']}")
-    print(f"       Status: {result['status_code']} | {result['summary']}")
+    print(f"       Status: {result['status_code']} | {result['latency_ms']:.0f} ms | {result['summary']}")
 
     if show_details and result.get("full_response"):
         print(f"       Response: {json.dumps(result['full_response'], indent=2)[:500]}...")
     print()
 
 
+def print_latency_table(results: list) -> dict:
+    """Print per-test and overall latency percentiles and return them."""
+    by_test = {}
+    for r in results:
+        by_test.setdefault(r["name"], []).append(r["latency_ms"])
+
+    summaries = {name: latency_summary(by_test[name]) for name in sorted(by_test)}
+    overall = latency_summary([r["latency_ms"] for r in results])
+
+    print(f"{'Latency (ms)':<32} {'runs':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, summary in list(summaries.items()) + [("OVERALL", overall)]:
+        print(
+            f"{name[:32]:<32} {summary['count']:>5} {summary['p50']:9.0f} "
+            f"{summary['p95']:9.0f} {summary['p99']:9.0f} {summary['max']:9.0f}"
+        )
+    print()
+    return {"tests": summaries, "overall": overall}
+
+
+def export_results(path: str, results: list, latency: dict, parallel: int, repeat: int):
+    """Write the run's results and latency percentiles to a JSON file."""
+    passed = sum(1 for r in results if r["passed"])
+    report = {
+        "endpoint": API_ENDPOINT,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parallel": parallel,
+        "repeat": repeat,
+        "total": len(results),
+        "passed": passed,
+        "failed": len(results) - passed,
+        "latency_ms": latency,
+        "results": [
+            {key: value for key, value in r.items() if key != "full_response"}
+            for r in results
+        ],
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+
+# Upper bounds (ms) of the load test latency histogram buckets
+HISTOGRAM_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 180000]
+
+
+def status_label(response: dict) -> str:
+    """HTTP status code as a string, or "timeout"/"error" when there was none."""
+    if response["status_code"] is not None:
+        return str(response["status_code"])
+    if "timed out" in str(response["error"]).lower():
+        return "timeout"
+    return "error"
+
+
+def load_response_ok(name: str, response: dict) -> bool:
+    """
+    True if a load test response is a success. As in run_test, error_*
+    events pass on any HTTP response, including the errors they provoke.
+    """
+    if response["status_code"] is None:
+        return False
+    return name.startswith("error_") or response["status_code"] < 400
+
+
+def print_histogram(latencies: list):
+    """Print a latency histogram with HISTOGRAM_BUCKETS_MS buckets."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for latency in latencies:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if latency <= bound), len(HISTOGRAM_BUCKETS_MS))
+        counts[index] += 1
+
+    largest = max(counts) or 1
+    labels = [f"<= {bound} ms" for bound in HISTOGRAM_BUCKETS_MS] + [f"> {HISTOGRAM_BUCKETS_MS[-1]} ms"]
+    for label, count in zip(labels, counts):
+        if count:
+            share = count / len(latencies) * 100
+            print(f"  {label:>12} {count:>7} {share:6.1f}% {'#' * max(1, round(count / largest * 40))}")
+    return dict(zip(labels, counts))
+
+
+def run_load_test(
+    rate: float,
+    duration: float,
+    events_dir: str = "events",
+    skip_scoring: bool = False,
+    filter_name: str = None,
+    timeout: int = 180,
+    max_in_flight: int = 256,
+    json_output: str = None
+) -> dict:
+    """
+    Send events open-loop at a fixed rate for a fixed duration.
+
+    Request i is scheduled at start + i / rate whether or not earlier
+    requests have finished, cycling through the test events. Latency is
+    measured from the scheduled time, so time spent waiting for a free
+    worker counts (coordinated-omission correction); service latency
+    measured from the actual send is reported alongside. As in run_test,
+    error_* events are expected to fail, so their error responses count as
+    successes.
+    """
+    test_events = load_test_events(events_dir)
+    if filter_name:
+        test_events = [t for t in test_events if filter_name.lower() in t["name"].lower()]
+    if not test_events:
+        print("No test events found!")
+        return {}
+    if skip_scoring:
+        for t in test_events:
+            t["event"]["skip_scoring"] = True
+
+    total = max(1, int(rate * duration))
+    interval = 1 / rate
+    print("=" * 60)
+    print("fetchAgentsRecursively Load Test (open loop)")
+    print("=" * 60)
+    print(f"Endpoint: {API_ENDPOINT}")
+    print(f"Rate: {rate:g} req/s for {duration:g} s ({total} requests, {len(test_events)} event(s))")
+    print(f"Max in flight: {max_in_flight}")
+    print()
+
+    samples = []
+    samples_lock = threading.Lock()
+
+    def fire(test_case: dict, scheduled: float):
+        event, checks = split_event(test_case["event"])
+        sent = time.perf_counter()
+        response = call_api(event, timeout, checks.get("headers"))
+        finished = time.perf_counter()
+        with samples_lock:
+            samples.append({
+                "name": test_case["name"],
+                "status": status_label(response),
+                "ok": load_response_ok(test_case["name"], response),
+                "latency_ms": (finished - scheduled) * 1000,
+                "service_ms": response["latency_ms"],
+                "queued_ms": (sent - scheduled) * 1000,
+            })
+
+    start = time.perf_counter() + 0.05
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        for i in range(total):
+            scheduled = start + i * interval
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            executor.submit(fire, test_events[i % len(test_events)], scheduled)
+        send_elapsed = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    by_status = {}
+    for sample in samples:
+        by_status[sample["status"]] = by_status.get(sample["status"], 0) + 1
+    ok = sum(1 for sample in samples if sample["ok"])
+    expected_errors = sum(
+        1 for sample in samples
+        if sample["name"].startswith("error_") and sample["status"].isdigit() and int(sample["status"]) >= 400
+    )
+    corrected = [sample["latency_ms"] for sample in samples]
+    service = [sample["service_ms"] for sample in samples]
+
+    print(f"Sent:        {total} in {send_elapsed:.1f} s ({total / send_elapsed:.1f} req/s offered)")
+    print(f"Completed:   {len(samples)} in {elapsed:.1f} s ({len(samples) / elapsed:.1f} req/s throughput)")
+    print(f"Successful:  {ok} ({ok / elapsed:.1f} req/s, {expected_errors} expected errors from error_* events)")
+    print()
+    print("By status:")
+    for status, count in sorted(by_status.items()):
+        print(f"  {status:>8} {count:>7} {count / len(samples) * 100:6.1f}%")
+    print(f"Error rate:   {(len(samples) - ok) / len(samples) * 100:.2f}%")
+    print(f"Timeout rate: {by_status.get('timeout', 0) / len(samples) * 100:.2f}%")
+    print()
+    print("Latency histogram (corrected):")
+    histogram = print_histogram(corrected)
+    print()
+
+    percentiles = {}
+    print(f"{'Latency (ms)':<12} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}")
+    for label, values in (("corrected", corrected), ("service", service)):
+        percentiles[label] = {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "p99.9": percentile(values, 99.9),
+            "max": max(values),
+        }
+        print(f"{label:<12} " + " ".join(f"{value:9.0f}" for value in percentiles[label].values()))
+    print()
+
+    report = {
+        "endpoint": API_ENDPOINT,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "rate": rate,
+        "duration": duration,
+        "max_in_flight": max_in_flight,
+        "sent": total,
+        "completed": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(len(samples) / elapsed, 2),
+        "successful": ok,
+        "expected_errors": expected_errors,
+        "by_status": by_status,
+        "error_rate": round((len(samples) - ok) / len(samples), 4),
+        "timeout_rate": round(by_status.get("timeout", 0) / len(samples), 4),
+        "histogram_ms": histogram,
+        "latency_ms": percentiles,
+    }
+    if json_output:
+        with open(json_output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {json_output}")
+    return report
+
+
 def run_all_tests(
     events_dir: str = "events",
     verbose: bool = False,
     skip_scoring: bool = False,
     filter_name: str = None,
-    timeout: int = 180
+    timeout: int = 180,
+    parallel: int = 1,
+    repeat: int = 1,
+    json_output: str = None
 ):
-    """Run all tests and print summary."""
+    """
+    Run all tests and print summary.
+
+    Each test runs repeat times; with parallel > 1 up to that many requests
+    are in flight at once.
+    """
     print("=" * 60)
     print("fetchAgentsRecursively API Test Runner")
     print("=" * 60)
@@ -167,15 +492,27 @@ def run_all_tests(
         for t in test_events:
             t["event"]["skip_scoring"] = True
 
-    print(f"Running {len(test_events)} test(s)...\n")
+    runs = [test_case for _ in range(max(1, repeat)) for test_case in test_events]
+    parallel = max(1, parallel)
+    print(f"Running {len(test_events)} test(s) x {max(1, repeat)} (parallel: {parallel})...\n")
     print("-" * 60)
 
     results = []
-    for test_case in test_events:
-        print(f"Running: {test_case['name']}...")
-        result = run_test(test_case, verbose, timeout)
-        results.append(result)
-        print_result(result, verbose)
+    if parallel == 1:
+        for test_case in runs:
+            print(f"Running: {test_case['name']}...")
+            result = run_test(test_case, verbose, timeout)
+            results.append(result)
+            print_result(result, verbose)
+    else:
+        print_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            futures = [executor.submit(run_test, test_case, verbose, timeout) for test_case in runs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                with print_lock:
+                    print_result(result, verbose)
 
     # Summary
     print("=" * 60)
@@ -196,6 +533,11 @@ def run_all_tests(
                 print(f"  - {r['name']}: {r['summary']}")
 
     print()
+    latency = print_latency_table(results)
+
+    if json_output:
+        export_results(json_output, results, latency, parallel, max(1, repeat))
+
     return results
 
 
@@ -237,6 +579,41 @@ def main():
         type=str,
         help="Override API endpoint URL"
     )
+    parser.add_argument(
+        "-p", "--parallel",
+        type=int,
+        default=1,
+        help="Number of requests in flight at once (default: 1)"
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        type=int,
+        default=1,
+        help="Run each test this many times (default: 1)"
+    )
+    parser.add_argument(
+        "-l", "--load",
+        type=float,
+        metavar="RATE",
+        help="Open-loop load test: send events at RATE requests/second"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30,
+        help="Load test duration in seconds (default: 30)"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=256,
+        help="Max concurrent requests in load mode (default: 256)"
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Write results and latency percentiles to this JSON file"
+    )
 
     args = parser.parse_args()
 
@@ -246,12 +623,28 @@ def main():
         API_ENDPOINT = args.endpoint
         print(f"Using custom endpoint: {API_ENDPOINT}")
 
+    if args.load:
+        report = run_load_test(
+            rate=args.load,
+            duration=args.duration,
+            events_dir=args.events_dir,
+            skip_scoring=args.skip_scoring,
+            filter_name=args.filter,
+            timeout=args.timeout,
+            max_in_flight=args.max_in_flight,
+            json_output=args.json
+        )
+        sys.exit(0 if report and report["successful"] == report["sent"] else 1)
+
     results = run_all_tests(
         events_dir=args.events_dir,
         verbose=args.verbose,
         skip_scoring=args.skip_scoring,
         filter_name=args.filter,
-        timeout=args.timeout
+        timeout=args.timeout,
+        parallel=args.parallel,
+        repeat=args.repeat,
+        json_output=args.json
     )
 
     # Exit with error code if any tests failed